@@ -2,12 +2,27 @@ import dash
 from dash import html, dcc
 from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
+from caching import CallbackCache
+import safety_score
 from safety_score import safetyScore
 
 # Initialize the Dash app with a Bootstrap theme for better styling
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 server = app.server  # For deployment purposes
 
+# Score cards keyed on the route, race, sex and model version. Routes can change
+# with traffic, so entries expire with the directions cache.
+callback_cache = CallbackCache.from_env(ttl=safety_score.directions.cache.ttl)
+server.add_url_rule(
+    "/cache-stats",
+    "cache_stats",
+    lambda: {
+        "callbacks": callback_cache.stats(),
+        "scores": safety_score.score_cache.stats(),
+        "directions": safety_score.directions.stats(),
+    },
+)
+
 # Define the layout of the app
 app.layout = dbc.Container(
     [
@@ -111,12 +126,19 @@ def update_output(n_clicks, start, end, race, sex):
         return ""
     if not start or not end:
         return dbc.Alert("Please enter both start and end locations.", color="warning")
-    
+    try:
+        return safety_result(start, end, race, sex)
+    except ValueError:
+        return dbc.Alert("An error occurred while calculating the safety score. Please try again.", color="danger")
+
+@callback_cache.memoize(version=lambda: safety_score.model.version)
+def safety_result(start, end, race, sex):
     # Calculate the safety score
     score = safetyScore(start, end, race, sex)
     
     if score is None:
-        return dbc.Alert("An error occurred while calculating the safety score. Please try again.", color="danger")
+        # Raised rather than returned, so a failed lookup is retried instead of cached
+        raise ValueError("Could not calculate the safety score.")
     
     # Determine the safety level based on the score
     if score >= 75:
@@ -0,0 +1,322 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Marks a cache miss, so None can be cached like any other value
+missing = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU cache with an optional time-to-live and
+    hit/miss counters.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=missing):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=missing):
+        # Like get, but without touching the counters or the LRU order
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > self.clock()):
+                return entry[0]
+            return default
+
+    def put(self, key, value):
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function and everyone who asks for that key meanwhile gets its result
+    (or its exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class SQLiteCache:
+    """
+    Size-bounded cache in a local SQLite file, so several worker processes
+    on one machine can share results. Values are pickled; keys are strings.
+    Least recently used rows are evicted once there are more than maxsize;
+    the check runs every evict_every writes to keep puts cheap.
+    """
+
+    def __init__(self, path, maxsize=100_000, ttl=None, clock=time.time, evict_every=100):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads, so keep one per thread.
+        # Nor can they be used across fork() (gunicorn --preload builds this cache in the
+        # master), so a forked worker opens its own and leaves the inherited one untouched.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, default=missing):
+        connection = self._connection()
+        now = self.clock()
+        row = connection.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            self.misses += 1
+            return default
+        with connection:
+            connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        now = self.clock()
+        expires = now + self.ttl if self.ttl is not None else None
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires, now),
+            )
+            self._puts += 1
+            if self._puts % self.evict_every:
+                return
+            connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self),
+            'maxsize': self.maxsize,
+        }
+
+
+class TieredCache:
+    """
+    An in-process LRU in front of an optional shared store (e.g. SQLiteCache).
+    Shared hits are copied into the in-process tier.
+    """
+
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+
+    def get(self, key, default=missing):
+        value = self.memory.get(key)
+        if value is missing and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not missing:
+                self.memory.put(key, value)
+        return default if value is missing else value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.shared is not None:
+            self.shared.put(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        memory = self.memory.stats()
+        shared = self.shared.stats() if self.shared is not None else None
+        lookups = memory['hits'] + memory['misses']
+        hits = memory['hits'] + (shared['hits'] if shared else 0)
+        return {
+            'hits': hits,
+            'misses': lookups - hits,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'memory': memory,
+            'shared': shared,
+        }
+
+
+def file_version(path):
+    """
+    Fingerprint of a data file or directory tree from the names, sizes and
+    modification times of its files, without reading them.
+    """
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    digest = hashlib.sha256()
+    for file in files:
+        stat = os.stat(file)
+        digest.update(f"{os.path.relpath(file, path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+class CallbackCache:
+    """
+    Memoizes Dash callback results on the callback's name, its arguments and
+    a dataset version. Results live in a TieredCache: an in-process LRU plus,
+    with shared_path, a SQLite file shared by all gunicorn workers on the
+    machine (results must then be picklable). Identical concurrent calls are
+    coalesced so only one of them computes.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, shared_path=None, shared_maxsize=100_000):
+        self.cache = TieredCache(
+            LRUCache(maxsize=maxsize, ttl=ttl),
+            SQLiteCache(shared_path, maxsize=shared_maxsize, ttl=ttl) if shared_path else None,
+        )
+        self.in_flight = SingleFlight()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        # Set CALLBACK_CACHE_PATH to a SQLite file to share results between worker processes
+        return cls(shared_path=os.environ.get("CALLBACK_CACHE_PATH") or None, **kwargs)
+
+    @staticmethod
+    def key(name, version, args, kwargs):
+        # Callback inputs are JSON, so the key is a digest of their canonical JSON form
+        payload = json.dumps([name, version, args, kwargs], sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def memoize(self, version=None):
+        """
+        Decorator. version is a value or a zero-argument callable (e.g. the
+        loaded dataset's fingerprint) that is part of every key, so results
+        computed from older data are never served. Apply it beneath
+        @app.callback.
+        """
+        def decorator(fn):
+            name = f"{fn.__module__}.{fn.__qualname__}"
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = self.key(name, version() if callable(version) else version, args, kwargs)
+                result = self.cache.get(key)
+                if result is missing:
+                    result = self.in_flight.do(key, lambda: self._compute(key, fn, args, kwargs))
+                return result
+
+            wrapper.uncached = fn
+            return wrapper
+        return decorator
+
+    def _compute(self, key, fn, args, kwargs):
+        # Another caller may have stored the result while we waited to become the leader
+        result = self.cache.memory.peek(key)
+        if result is missing:
+            result = fn(*args, **kwargs)
+            self.cache.put(key, result)
+        return result
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return dict(self.cache.stats(), coalesced=self.in_flight.coalesced)
@@ -1,58 +1,63 @@
-import geopandas as gpd
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import os
+import re
+import sys
 import glob
 import matplotlib as mpl
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import product
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
 from ipywidgets import interact, Dropdown, fixed
+from IPython.display import display
+import data_layer
+
+shapefile_path = '/Users/sarvy/Downloads/ne_110m_admin_1_states_provinces/ne_110m_admin_1_states_provinces.shp'  # Update with your shapefile path
+folder_path = '/Users/sarvy/Desktop/OpenPolicing/OpenPolicing/aggregated_data'  # Update with the Parquet dataset written by moveDataset.py
+
+# Filter choices as (label, value) pairs, shared by the widgets and the batch renderer
+age_options = [('Unknown', 'unknown'), ('20-29', '20-29'), ('30-39', '30-39'), ('40-49', '40-49'), ('All', None)]
+sex_options = [('Unknown', 'unknown'), ('Male', 'male'), ('Female', 'female'), ('All', None)]
+race_options = [('Unknown', 'unknown'), ('White', 'white'), ('Black', 'black'),
+                ('Asian', 'asian/pacific islander'), ('Hispanic', 'hispanic'), ('Other', 'other'), ('All', None)]
+
+# Worker processes for render_all (None means one per CPU)
+max_workers = None
+
+state_abbr_to_name = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
+    'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
+    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
+    'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 
+    'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire',
+    'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina',
+    'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania',
+    'RI': 'Rhode Island', 'SC': 'South Carolina', 'SD': 'South Dakota', 'TN': 'Tennessee',
+    'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington',
+    'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming'
+}
 
 # Step 1: Load U.S. State Boundaries from Natural Earth Shapefile
 def load_us_states(shapefile_path):
-    # Load the shapefile
-    states = gpd.read_file(shapefile_path)
-    # Filter for U.S. states only (assuming 'iso_a2' or similar column for country code)
-    us_states = states[states['iso_a2'] == 'US']
-    return us_states
+    # Read once per shapefile and shared by every redraw (see data_layer)
+    return data_layer.load_us_states(shapefile_path)
 
-# Step 2: Load and Combine Traffic Stop Data for All States
+# Step 2: Look up the Traffic Stop Totals for All States
 def load_traffic_stop_data(file_path, age=None, sex=None, race=None):
-    # Initialize an empty DataFrame to store all states' data
-
-    state_abbr_to_name = {
-        'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
-        'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
-        'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa',
-        'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
-        'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 
-        'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire',
-        'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York', 'NC': 'North Carolina',
-        'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania',
-        'RI': 'Rhode Island', 'SC': 'South Carolina', 'SD': 'South Dakota', 'TN': 'Tennessee',
-        'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington',
-        'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming'
-    }
-
-    # Initialize an empty DataFrame to store all states' data
-    traffic_data = pd.read_csv(file_path)
-    
-    # Check if 'state' column exists
-    if 'state' not in traffic_data.columns:
-        print("Missing 'state' column in the dataset.")
-        return None
-    
-    traffic_data['subject_age'] = traffic_data['subject_age'].fillna('Unknown')
-    traffic_data['subject_race'] = traffic_data['subject_race'].fillna('Unknown')
-    traffic_data['subject_sex'] = traffic_data['subject_sex'].fillna('Unknown')
-
-    # Aggregate by state to get the total count of stops per state
-    grouped_data = traffic_data.groupby(['state', 'subject_age', 'subject_race', 'subject_sex'], as_index=False)['count'].sum()
+    # The data is read and indexed once per path by the shared demographic cube
+    # (the same engine the Dash app queries); each filter combination is then an
+    # array lookup, cached after the first time it is asked for
+    cube = data_layer.load_demographic_cube(file_path)
+    state_data = cube.state_counts(age=age, race=race, sex=sex)
 
     # Map state abbreviations to full names
-    grouped_data['state'] = grouped_data['state'].map(state_abbr_to_name)
-
-    # Now aggregate by state, summing the 'count' column to get the total count per state
-    aggregated_data = grouped_data.groupby('state', as_index=False)['count'].sum()
-    aggregated_data = aggregated_data.rename(columns={'count': 'stop_count'})
+    state_data['state'] = state_data['state'].astype(str).map(state_abbr_to_name)
+    aggregated_data = state_data.dropna(subset=['state']).rename(columns={'count': 'stop_count'})
 
     print("Aggregated Data by State:")
 
@@ -61,67 +66,151 @@ def load_traffic_stop_data(file_path, age=None, sex=None, race=None):
     return aggregated_data
 
 
-def merge_data(us_states, traffic_stops):
-    # Merge the GeoDataFrame with the traffic stops data
-    print("Columns in us_states:", us_states.columns)
-    print("Columns in traffic_stops:", traffic_stops.columns)
-    traffic_stops = traffic_stops.rename(columns={'state': 'name'})
-    us_map = us_states.merge(traffic_stops, on='name', how='left')
-    return us_map
+class StateChoropleth:
+    """
+    A matplotlib state map drawn once and recoloured in place.
+
+    The state shapes are turned into a single PatchCollection up front, and
+    every state of the demographic cube is mapped to its geometry row by
+    postal code, so a redraw is an index gather into the collection's
+    colour array: no GeoDataFrame merge and no new patches.
+    """
+
+    def __init__(self, us_states, states, figsize=(15, 10), cmap='OrRd'):
+        postal = pd.Index(us_states['postal'].astype(str))
+        # Geometry row of each cube state, -1 for states we have no shape for
+        self.state_rows = postal.get_indexer(list(states))
+        self.num_shapes = len(us_states)
+
+        paths, path_rows = [], []
+        for row, geometry in enumerate(us_states.geometry):
+            polygons = getattr(geometry, 'geoms', [geometry])
+            for polygon in polygons:
+                rings = [polygon.exterior] + list(polygon.interiors)
+                paths.append(Path.make_compound_path(*[Path(np.asarray(ring.coords)[:, :2]) for ring in rings]))
+                path_rows.append(row)
+        # Multi-part states (islands) have several patches; each patch knows its state row
+        self.path_rows = np.array(path_rows, dtype=np.int64)
+
+        self.figure, self.ax = plt.subplots(1, 1, figsize=figsize)
+        self.collection = PatchCollection(
+            [PathPatch(path) for path in paths],
+            cmap=mpl.colormaps[cmap].with_extremes(bad=(0, 0, 0, 0)),
+            linewidth=0.8,
+            edgecolor='0.8',
+        )
+        self.ax.add_collection(self.collection)
+        self.ax.autoscale_view()
+        self.ax.set_aspect('equal')
+        self.ax.set_axis_off()  # Hide axes for a cleaner look
+
+        # The colour bar follows the collection, so it updates with it
+        cbar = self.figure.colorbar(self.collection, ax=self.ax)
+        cbar.set_label("Traffic Stop Counts", fontsize=12)
+
+    def shape_values(self, counts):
+        # Counts in cube state order -> one value per patch; states without stops stay blank
+        values = np.full(self.num_shapes, np.nan)
+        known = self.state_rows >= 0
+        values[self.state_rows[known]] = counts[known]
+        values[values == 0] = np.nan
+        return values[self.path_rows]
+
+    def draw(self, counts, title="Traffic Stops by State"):
+        values = self.shape_values(counts)
+        self.collection.set_array(np.ma.masked_invalid(values))
+        if np.isfinite(values).any():
+            self.collection.set_clim(np.nanmin(values), np.nanmax(values))
+        self.ax.set_title(title, fontsize=15)
+        self.figure.canvas.draw_idle()
+        return self.figure
+
+
+@lru_cache(maxsize=None)
+def state_choropleth(shapefile_path, data_file_path):
+    # One figure per shapefile/dataset pair, reused for every widget change
+    cube = data_layer.load_demographic_cube(data_file_path)
+    return StateChoropleth(load_us_states(shapefile_path), cube.states)
+
+
+def map_title(age, sex, race):
+    filters = [f"{name}: {value}" for name, value in (('age', age), ('sex', sex), ('race', race)) if value is not None]
+    return "Traffic Stops by State" + (f" ({', '.join(filters)})" if filters else "")
+
 
 # Step 4: Plot the Choropleth Map
-def plot_choropleth(us_map):
-    # Create the plot
-    # Create the plot
-    fig, ax = plt.subplots(1, 1, figsize=(15, 10))
-    
-    # Plot the choropleth without the legend parameter
-    us_map.plot(
-        column='stop_count', 
-        cmap='OrRd', 
-        linewidth=0.8, 
-        ax=ax, 
-        edgecolor='0.8'
-    )
-    
-    # Create a color bar as a separate item
-    sm = plt.cm.ScalarMappable(cmap='OrRd', norm=mpl.colors.Normalize(vmin=us_map['stop_count'].min(), vmax=us_map['stop_count'].max()))
-    sm._A = []  # Dummy array for the color bar
-    
-    # Add the color bar to the plot
-    cbar = fig.colorbar(sm, ax=ax)
-    cbar.set_label("Traffic Stop Counts", fontsize=12)
-    
-    # Customize the plot
-    ax.set_title("Traffic Stops by State", fontsize=15)
-    ax.set_axis_off()  # Hide axes for a cleaner look
-    plt.show()
+def plot_choropleth(shapefile_path, data_file_path, age=None, sex=None, race=None):
+    counts = data_layer.load_demographic_cube(data_file_path).counts(age=age, race=race, sex=sex)
+    return state_choropleth(shapefile_path, data_file_path).draw(counts, map_title(age, sex, race))
 
 def interactive_map(shapefile_path, data_file_path, age, sex, race):
-    us_states = load_us_states(shapefile_path)
-    traffic_stops = load_traffic_stop_data(data_file_path, age=age, sex=sex, race=race)
-    print(traffic_stops)
-    us_map = merge_data(us_states, traffic_stops)
-    plot_choropleth(us_map)
+    # Show the same figure again, recoloured for the new filters
+    display(plot_choropleth(shapefile_path, data_file_path, age=age, sex=sex, race=race))
+
+
+def map_file_name(age, sex, race):
+    parts = [value if value is not None else 'all' for value in (age, sex, race)]
+    return "stops_" + "_".join(re.sub(r'[^a-z0-9-]+', '-', part.lower()) for part in parts)
+
+
+def render_batch(shapefile_path, data_file_path, output_dir, combinations, formats):
+    """
+    Render one chunk of filter combinations in a worker process. The figure
+    is built once per worker and only recoloured for each combination.
+    """
+    mpl.use('Agg')
+    written = []
+    for age, sex, race in combinations:
+        figure = plot_choropleth(shapefile_path, data_file_path, age=age, sex=sex, race=race)
+        for file_format in formats:
+            path = os.path.join(output_dir, f"{map_file_name(age, sex, race)}.{file_format}")
+            figure.savefig(path, bbox_inches='tight')
+            written.append(path)
+    return written
+
+
+def render_all(shapefile_path=shapefile_path, data_file_path=folder_path, output_dir='static_maps',
+               formats=('png', 'svg'), max_workers=max_workers):
+    """
+    Pre-render the state map for every age/sex/race combination of the
+    dropdowns, for the static report site. Combinations are split into one
+    chunk per worker process.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    combinations = list(product(
+        [value for _, value in age_options],
+        [value for _, value in sex_options],
+        [value for _, value in race_options],
+    ))
+    num_workers = max_workers or os.cpu_count() or 1
+    chunks = [combinations[i::num_workers] for i in range(num_workers) if combinations[i::num_workers]]
+
+    written = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(render_batch, shapefile_path, data_file_path, output_dir, chunk, tuple(formats))
+            for chunk in chunks
+        ]
+        for future in as_completed(futures):
+            written.extend(future.result())
+    print(f"Rendered {len(combinations)} maps ({len(written)} files) to {output_dir}")
+    return written
 
 # Main Function to Execute All Steps
 def main():
-    shapefile_path = '/Users/sarvy/Downloads/ne_110m_admin_1_states_provinces/ne_110m_admin_1_states_provinces.shp'  # Update with your shapefile path
-    folder_path = '/Users/sarvy/Desktop/OpenPolicing/OpenPolicing/aggregated_data.csv'  # Update with the folder path containing CSV files
-
     # Load data
     age_dropdown = Dropdown(
-        options=['Unknown', '20-29', '30-39', '40-49', None], 
+        options=age_options, 
         value=None, 
         description='Age:'
     )
     sex_dropdown = Dropdown(
-        options=['Unknown', 'Male', 'Female', None], 
+        options=sex_options, 
         value=None, 
         description='Sex:'
     )
     race_dropdown = Dropdown(
-        options=['Unknown', 'White', 'Black', 'Asian', 'Hispanic', None], 
+        options=race_options, 
         value=None, 
         description='Race:'
     )
@@ -142,4 +231,8 @@ def main():
 
 # Run the main function
 if __name__ == "__main__":
-    main()
+    # python chloropleth_map.py render [output_dir] pre-renders every filter combination
+    if len(sys.argv) > 1 and sys.argv[1] == 'render':
+        render_all(output_dir=sys.argv[2] if len(sys.argv) > 2 else 'static_maps')
+    else:
+        main()
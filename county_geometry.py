@@ -0,0 +1,154 @@
+import gzip
+import json
+import math
+import os
+import threading
+from functools import lru_cache
+
+import geopandas as gpd
+import shapely
+from shapely.geometry import mapping
+
+# Full resolution Natural Earth county shapes, only read when a simplified file is missing
+counties_shapefile = 'ne_10m_admin_2_counties/ne_10m_admin_2_counties.shp'  # Replace with your file path
+
+# Where the simplified per-state county GeoJSON files are kept
+geometry_dir = 'county_geometries'
+
+# Simplification tolerance (in degrees) for each zoom level
+zoom_tolerances = {
+    'low': 0.02,
+    'medium': 0.005,
+    'high': 0.001,
+}
+
+# Rough width in pixels of the county map; a level is detailed enough when its
+# tolerance is no more than about one pixel at that width
+map_width_px = 600
+
+# Natural Earth identifies US states by FIPS code in ISO_3166_2 (e.g. Georgia is US-13)
+state_fips = {
+    'AL': '01', 'AK': '02', 'AZ': '04', 'AR': '05', 'CA': '06', 'CO': '08', 'CT': '09',
+    'DE': '10', 'DC': '11', 'FL': '12', 'GA': '13', 'HI': '15', 'ID': '16', 'IL': '17',
+    'IN': '18', 'IA': '19', 'KS': '20', 'KY': '21', 'LA': '22', 'ME': '23', 'MD': '24',
+    'MA': '25', 'MI': '26', 'MN': '27', 'MS': '28', 'MO': '29', 'MT': '30', 'NE': '31',
+    'NV': '32', 'NH': '33', 'NJ': '34', 'NM': '35', 'NY': '36', 'NC': '37', 'ND': '38',
+    'OH': '39', 'OK': '40', 'OR': '41', 'PA': '42', 'RI': '44', 'SC': '45', 'SD': '46',
+    'TN': '47', 'TX': '48', 'UT': '49', 'VT': '50', 'VA': '51', 'WA': '53', 'WV': '54',
+    'WI': '55', 'WY': '56',
+}
+
+
+def state_iso_code(state):
+    return f"US-{state_fips[state]}"
+
+
+def geometry_file(state, zoom, geometry_dir=geometry_dir):
+    return os.path.join(geometry_dir, f"{state}_{zoom}.geojson.gz")
+
+
+def simplify_counties(geometries, tolerance):
+    """
+    Simplify a state's counties without opening gaps or overlaps between
+    neighbours. Coverage simplification (shapely >= 2.1) simplifies each
+    shared edge once; older shapely falls back to per-polygon simplification.
+    """
+    geometries = shapely.make_valid(geometries)
+    if hasattr(shapely, 'coverage_simplify'):
+        return shapely.coverage_simplify(geometries, tolerance)
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def round_coordinates(coordinates, decimals):
+    if isinstance(coordinates[0], (int, float)):
+        return [round(value, decimals) for value in coordinates]
+    return [round_coordinates(part, decimals) for part in coordinates]
+
+
+def to_geojson(counties, geometries, decimals):
+    # Minimal GeoJSON: numbered feature ids, the county name and rounded coordinates
+    features = []
+    for i, (name, geometry) in enumerate(zip(counties['NAME'], geometries)):
+        if geometry is None or geometry.is_empty:
+            continue
+        shape = mapping(geometry)
+        features.append({
+            'type': 'Feature',
+            'id': str(i),
+            'properties': {'county_name': name},
+            'geometry': {'type': shape['type'], 'coordinates': round_coordinates(shape['coordinates'], decimals)},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def build_state_geometries(counties, state, geometry_dir=geometry_dir, zooms=None):
+    """
+    Write the simplified county GeoJSON for one state at each zoom level.
+    `counties` is the county GeoDataFrame (or any superset of the state's rows).
+    """
+    state_counties = counties[counties['ISO_3166_2'] == state_iso_code(state)]
+    os.makedirs(geometry_dir, exist_ok=True)
+    written = []
+    for zoom in zooms or zoom_tolerances:
+        tolerance = zoom_tolerances[zoom]
+        geometries = simplify_counties(state_counties.geometry.values, tolerance)
+        # Keep about a tenth of the tolerance in the stored coordinates
+        decimals = max(3, math.ceil(-math.log10(tolerance)) + 1)
+        geojson = to_geojson(state_counties, geometries, decimals)
+
+        path = geometry_file(state, zoom, geometry_dir)
+        # Unique per process and thread, so concurrent first requests never share a temp file
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(geojson, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        written.append(path)
+    return written
+
+
+def build_all(counties_shapefile=counties_shapefile, geometry_dir=geometry_dir):
+    # Precompute step: simplified county geometries for every state and zoom level
+    counties = gpd.read_file(counties_shapefile, columns=['NAME', 'ISO_3166_2'])
+    written = []
+    for state in state_fips:
+        written.extend(build_state_geometries(counties, state, geometry_dir))
+    return written
+
+
+def zoom_for_span(span_degrees, width_px=map_width_px):
+    """
+    The coarsest zoom level that still looks exact when a region span_degrees
+    wide is fitted to the map: big states get 'low', small ones 'high'.
+    """
+    degrees_per_pixel = span_degrees / width_px
+    fitting = [zoom for zoom, tolerance in zoom_tolerances.items() if tolerance <= degrees_per_pixel]
+    if not fitting:
+        return min(zoom_tolerances, key=zoom_tolerances.get)
+    return max(fitting, key=zoom_tolerances.get)
+
+
+@lru_cache(maxsize=None)
+def load_county_geojson(state, zoom='medium', geometry_dir=geometry_dir):
+    """
+    Simplified county GeoJSON for a state, kept in memory after the first
+    request. Builds (and stores) the state's files if they are missing.
+    Returns None for states we have no FIPS code for.
+    """
+    if state not in state_fips or zoom not in zoom_tolerances:
+        return None
+    path = geometry_file(state, zoom, geometry_dir)
+    if not os.path.exists(path):
+        # Only pull this state's rows out of the full resolution shapefile
+        counties = gpd.read_file(
+            counties_shapefile,
+            columns=['NAME', 'ISO_3166_2'],
+            where=f"ISO_3166_2 = '{state_iso_code(state)}'",
+        )
+        build_state_geometries(counties, state, geometry_dir, zooms=[zoom])
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    for path in build_all():
+        print(path)
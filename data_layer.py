@@ -0,0 +1,95 @@
+import os
+from functools import lru_cache
+
+import geopandas as gpd
+import pandas as pd
+
+from caching import file_version
+from demographic_cube import DemographicCube
+
+# Default data locations (replace with actual paths in your environment).
+# stop_data_path is the state-partitioned Parquet dataset written by moveDataset.py;
+# a path ending in .csv is read the old way.
+stop_data_path = "aggregated_data"
+crime_data_path = "crime_count_by_county.csv"
+shapefile_path = "ne_110m_admin_1_states_provinces/ne_110m_admin_1_states_provinces.shp"
+
+# Columns of aggregated_data the dashboards actually use
+stop_columns = ['state', 'subject_age', 'subject_race', 'subject_sex', 'count']
+
+# Everything below is loaded on first use and then shared. Calling preload() before
+# the server forks (e.g. gunicorn --preload with PRELOAD_DATA=1) loads it once in the
+# master so all workers share the same pages copy-on-write.
+
+
+@lru_cache(maxsize=None)
+def load_us_states(shapefile_path=shapefile_path):
+    # Read only the US rows and the columns we need straight from the shapefile
+    return gpd.read_file(shapefile_path, columns=['name', 'postal', 'iso_a2'], where="iso_a2 = 'US'")
+
+
+def read_stop_data(path=stop_data_path, columns=stop_columns, states=None, filters=None):
+    """
+    Read aggregated stop counts, only the given columns. From the Parquet
+    dataset, `states` prunes whole state partitions and `filters` (pyarrow
+    filter tuples, e.g. [('subject_race', '==', 'black')]) are pushed down
+    to the row groups.
+    """
+    if str(path).endswith('.csv'):
+        data = pd.read_csv(
+            path,
+            usecols=lambda column: column in columns,
+            dtype={'state': 'category', 'subject_race': 'category', 'subject_sex': 'category'},
+        )
+        if states is not None:
+            data = data[data['state'].isin(states)]
+        return data
+
+    filters = list(filters or [])
+    if states is not None:
+        filters.append(('state', 'in', list(states)))
+    return pd.read_parquet(path, columns=list(columns), filters=filters or None)
+
+
+@lru_cache(maxsize=None)
+def load_demographic_cube(path=stop_data_path):
+    # Fingerprint before reading, so the version never describes newer data than the cube holds
+    version = file_version(path)
+    # The cube parses ages and encodes race/sex itself, so the raw frame is not kept
+    return DemographicCube(read_stop_data(path), version=version)
+
+
+def dataset_version(path=stop_data_path):
+    """
+    Fingerprint of the stop data the loaded cube was built from. Cached
+    callback results are keyed on it, so a rebuilt dataset never serves
+    answers computed from the old one.
+    """
+    return load_demographic_cube(path).version
+
+
+@lru_cache(maxsize=None)
+def load_county_crime_counts(crime_data_path=crime_data_path):
+    # County crime counts we have, keyed by state
+    crime_data = pd.read_csv(crime_data_path, usecols=['county_name', 'crime_count'])
+    return {"GA": crime_data.groupby("county_name")["crime_count"].sum()}
+
+
+def query_raw_stops(group_by, states=None, **filters):
+    """
+    Ad-hoc stop counts straight from the raw per-state files (see raw_query),
+    for slices aggregated_data does not precompute, e.g. violation by race
+    for one state. Needs the optional duckdb package.
+    """
+    import raw_query
+    return raw_query.aggregate(group_by, states=states, **filters)
+
+
+def preload():
+    # Load the layers every worker needs up front
+    load_demographic_cube()
+    load_county_crime_counts()
+
+
+if os.environ.get("PRELOAD_DATA") == "1":
+    preload()
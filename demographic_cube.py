@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from caching import LRUCache, missing
+
+# Filter combinations whose state totals are kept per cube
+query_cache_size = 4096
+
+
+class DemographicCube:
+    """
+    Stop counts pre-aggregated into a dense (state, age, race, sex) array.
+
+    States, races and sexes are stored as integer codes and ages as whole
+    years, so answering a dropdown combination is an index lookup on a small
+    array instead of filtering and regrouping the raw aggregated data.
+    Answers are cached per filter combination and shared by the notebook
+    map and the Dash apps, so they are returned read-only. version is an
+    optional fingerprint of the data it was built from.
+    """
+
+    def __init__(self, data, cache_size=query_cache_size, version=None):
+        self.version = version
+        self.cache = LRUCache(maxsize=cache_size)
+        ages = pd.to_numeric(data['subject_age'], errors='coerce')
+        known_age = ages.notna().to_numpy()
+        # Match the old filter, which truncated ages with astype(int)
+        age_values = np.trunc(ages.to_numpy(dtype=float, na_value=np.nan))
+
+        self.states, state_codes = self._encode(data['state'])
+        self.races, race_codes = self._encode(data['subject_race'])
+        self.sexes, sex_codes = self._encode(data['subject_sex'])
+
+        if known_age.any():
+            self.min_age = int(age_values[known_age].min())
+            self.max_age = int(age_values[known_age].max())
+        else:
+            self.min_age, self.max_age = 0, -1
+        num_ages = self.max_age - self.min_age + 1
+
+        # Age slot num_ages holds rows without a usable age
+        age_codes = np.full(len(data), num_ages, dtype=np.int64)
+        age_codes[known_age] = age_values[known_age].astype(np.int64) - self.min_age
+
+        # Race/sex slot n holds missing values and slot n + 1 the total over all values
+        num_races, num_sexes = len(self.races), len(self.sexes)
+        race_codes = np.where(race_codes < 0, num_races, race_codes)
+        sex_codes = np.where(sex_codes < 0, num_sexes, sex_codes)
+
+        counts = np.zeros((len(self.states), num_ages + 1, num_races + 2, num_sexes + 2), dtype=np.int64)
+        # Rows without a state were dropped by the old groupby("state") as well
+        has_state = state_codes >= 0
+        np.add.at(
+            counts,
+            (state_codes[has_state], age_codes[has_state], race_codes[has_state], sex_codes[has_state]),
+            data['count'].to_numpy(dtype=np.int64)[has_state],
+        )
+        counts[:, :, num_races + 1, :] = counts[:, :, :num_races + 1, :].sum(axis=2)
+        counts[:, :, :, num_sexes + 1] = counts[:, :, :, :num_sexes + 1].sum(axis=3)
+
+        # Prefix sums over the known ages turn any age range into a difference of two rows
+        self.age_prefix = np.zeros((len(self.states), num_ages + 1, num_races + 2, num_sexes + 2), dtype=np.int64)
+        np.cumsum(counts[:, :num_ages], axis=1, out=self.age_prefix[:, 1:])
+        self.unknown_age = counts[:, num_ages]
+
+    @staticmethod
+    def _encode(column):
+        codes, uniques = pd.factorize(column, sort=True)
+        return {value: code for code, value in enumerate(uniques)}, codes
+
+    def _code(self, lookup, value):
+        # None selects the "all" slot; labels match case-insensitively and
+        # "unknown" falls back to the missing-value slot; unseen values select nothing
+        if value is None:
+            return len(lookup) + 1
+        if value in lookup:
+            return lookup[value]
+        value = str(value).lower()
+        if value in lookup:
+            return lookup[value]
+        if value == "unknown":
+            return len(lookup)
+        return None
+
+    def counts(self, age=None, race=None, sex=None):
+        """
+        Return the stop count for every state (in self.states order) that
+        matches the age range ("min-max", inclusive, or "unknown" for stops
+        without an age), race and sex filters.
+        """
+        key = (age, race, sex)
+        counts = self.cache.get(key)
+        if counts is missing:
+            counts = self._counts(age, race, sex)
+            counts.setflags(write=False)
+            self.cache.put(key, counts)
+        return counts
+
+    def _counts(self, age, race, sex):
+        race_code = self._code(self.races, race)
+        sex_code = self._code(self.sexes, sex)
+        if race_code is None or sex_code is None:
+            return np.zeros(len(self.states), dtype=np.int64)
+
+        prefix = self.age_prefix[:, :, race_code, sex_code]
+        num_ages = prefix.shape[1] - 1
+        if age is None:
+            return prefix[:, num_ages] + self.unknown_age[:, race_code, sex_code]
+        if str(age).lower() == "unknown":
+            return self.unknown_age[:, race_code, sex_code].copy()
+
+        min_age, max_age = map(int, age.split("-"))
+        lo = min(max(min_age - self.min_age, 0), num_ages)
+        hi = min(max(max_age - self.min_age + 1, 0), num_ages)
+        return prefix[:, max(hi, lo)] - prefix[:, lo]
+
+    def state_counts(self, age=None, race=None, sex=None):
+        """
+        Same as counts, as a (state, count) DataFrame of the states with stops.
+        """
+        counts = self.counts(age, race, sex)
+        state_data = pd.DataFrame({"state": list(self.states), "count": counts})
+        return state_data[state_data["count"] > 0].reset_index(drop=True)
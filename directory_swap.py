@@ -0,0 +1,39 @@
+import fcntl
+import os
+import shutil
+from contextlib import contextmanager
+
+
+@contextmanager
+def swap_lock(target_dir):
+    # Only one process (e.g. one gunicorn worker) builds or swaps target_dir at a time
+    with open(f"{target_dir}.lock", 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def replace_directory(tmp_dir, target_dir):
+    """
+    Swap the fully written tmp_dir in as target_dir. The previous target_dir
+    is moved aside first and only deleted once the new one is in place; if
+    the swap fails it is moved back and tmp_dir is removed, so target_dir is
+    never left without a complete version. Call it under swap_lock(target_dir)
+    so two processes never swap the same directory at once.
+    """
+    old_dir = f"{target_dir}.old-{os.getpid()}"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    had_old = os.path.exists(target_dir)
+    if had_old:
+        os.replace(target_dir, old_dir)
+    try:
+        os.replace(tmp_dir, target_dir)
+    except BaseException:
+        if had_old:
+            os.replace(old_dir, target_dir)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    if had_old:
+        shutil.rmtree(old_dir, ignore_errors=True)
@@ -0,0 +1,59 @@
+import numpy as np
+import plotly.graph_objects as go
+from dash import Patch
+
+
+def to_plotly_values(values):
+    # JSON-friendly list with None wherever a value is missing
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+class ChoroplethTemplate:
+    """
+    A choropleth whose static parts (locations, geo config, layout and
+    colorscale) are built once. Requests only swap the z values, hover text
+    and title, either in a copy of the base figure or as a Dash Patch that
+    updates a figure already shown in the browser.
+    """
+
+    def __init__(self, locations, title=None, geo=None, locationmode="USA-states", **trace_options):
+        self.locations = list(locations)
+        self._positions = {location: i for i, location in enumerate(self.locations)}
+        self.base = go.Figure(go.Choropleth(
+            locations=self.locations,
+            locationmode=locationmode,
+            z=[None] * len(self.locations),
+            **trace_options,
+        ))
+        self.base.update_layout(title=title, geo=geo if geo is not None else {"scope": "usa"})
+
+    def align(self, locations, values):
+        """
+        Spread (location, value) pairs over the template's location order;
+        locations without a value stay empty.
+        """
+        z = np.full(len(self.locations), np.nan)
+        for location, value in zip(locations, values):
+            position = self._positions.get(location)
+            if position is not None:
+                z[position] = value
+        return z
+
+    def figure(self, z, hovertext=None, title=None):
+        fig = go.Figure(self.base)
+        fig.update_traces(z=to_plotly_values(z))
+        if hovertext is not None:
+            fig.update_traces(hovertext=list(hovertext))
+        if title is not None:
+            fig.update_layout(title=title)
+        return fig
+
+    def patch(self, z, hovertext=None, title=None):
+        patched = Patch()
+        patched["data"][0]["z"] = to_plotly_values(z)
+        if hovertext is not None:
+            patched["data"][0]["hovertext"] = list(hovertext)
+        if title is not None:
+            patched["layout"]["title"]["text"] = title
+        return patched
@@ -1,49 +1,313 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
 import glob
-
-# Initialize an empty DataFrame to store aggregated data for all states
-all_data = pd.DataFrame()
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Path to the folder containing all state CSV files
 folder_path = '/Users/sarvy/Desktop/policing_dataset'  # Update with your actual folder path
 
-# Loop through each .csv file in the folder
-for file in glob.glob(os.path.join(folder_path, "*.csv")):
-    print(os.path.basename(file))
+# Partitioned Parquet dataset (one state=XX directory per state) written by the ingest
+output_path = '/Users/sarvy/Desktop/OpenPolicing/aggregated_data'  # Update with your desired output path
+
+# Optional flat CSV export of the dataset for tools that still need aggregated_data.csv (None to skip)
+output_file = None
+
+# Rows read from a state file at a time; peak memory per worker is bounded by this
+chunk_size = 1_000_000
+
+# Number of state files aggregated in parallel (None = one per CPU)
+max_workers = None
+
+# Columns we group on when the state file has them
+candidate_columns = ['subject_age', 'subject_sex', 'subject_race', 'violation']
+
+# Merge the per-chunk partial counts once this many have piled up
+merge_every = 16
+
+# Typed columnar layout of every part: whole-year ages, dictionary-encoded strings.
+# The state comes from the state=XX directory.
+categorical_columns = ['subject_sex', 'subject_race', 'violation']
+part_schema = pa.schema(
+    [('subject_age', pa.int16())]
+    + [(column, pa.dictionary(pa.int32(), pa.string())) for column in categorical_columns]
+    + [('count', pa.int64())]
+)
+
+# Bump when part_schema or the aggregation changes; parts written in another format are rebuilt
+part_format = 2
+
+# Per-state record of the source files behind each partition, used to skip unchanged states
+manifest_name = '_manifest.json'
+
+
+def state_from_filename(file):
     # Extract the state abbreviation from the filename
-    state_abbr = os.path.basename(file).split('_')[0].upper()  # Adjust if needed
+    return os.path.basename(file).split('_')[0].upper()  # Adjust if needed
+
+
+def partition_file(file, output_path=output_path):
+    # Each source file gets its own part inside its state's partition
+    state_dir = os.path.join(output_path, f"state={state_from_filename(file)}")
+    return os.path.join(state_dir, os.path.splitext(os.path.basename(file))[0] + '.parquet')
+
+
+def manifest_file(state, output_path=output_path):
+    # The leading underscore keeps Parquet readers from treating it as data
+    return os.path.join(output_path, f"state={state}", manifest_name)
+
+
+def load_manifests(output_path=output_path):
+    # Map state -> {source file name: record} for every partition written so far
+    manifests = {}
+    for path in glob.glob(os.path.join(output_path, "state=*", manifest_name)):
+        state = os.path.basename(os.path.dirname(path)).split('=', 1)[1]
+        with open(path) as f:
+            manifests[state] = json.load(f)
+    return manifests
+
+
+def save_manifest(state, entries, output_path=output_path):
+    path = manifest_file(state, output_path)
+    if not entries:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_hash(file, block_size=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(file):
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def is_unchanged(file, entry, output_path=output_path):
+    # Cheap check only: same size and mtime, and the partition (if any) is still on disk
+    if entry is None or entry.get('format') != part_format:
+        return False
+    if entry.get('part') and not os.path.exists(partition_file(file, output_path)):
+        return False
+    signature = file_signature(file)
+    return entry.get('size') == signature['size'] and entry.get('mtime') == signature['mtime']
+
+
+def detect_grouping_columns(file):
+    # Only read the header to find out which columns the state file has
+    columns = pd.read_csv(file, nrows=0).columns
+    return [column for column in candidate_columns if column in columns]
+
+
+def merge_counts(partials, grouping_columns):
+    # Sum partial counts that share the same group key
+    counts = pd.concat(partials)
+    return counts.groupby(level=list(range(len(grouping_columns)))).sum()
+
+
+def aggregate_state_file(file, chunksize=chunk_size):
+    """
+    Count stops per (age, sex, race, violation) combination in one state file,
+    reading it in chunks so the whole file never has to be in memory.
+    """
+    grouping_columns = detect_grouping_columns(file)
+    if not grouping_columns:
+        print(f"Skipping {os.path.basename(file)}: none of {candidate_columns} present.")
+        return None
+
+    # Read as strings so every chunk produces the same group keys
+    reader = pd.read_csv(file, usecols=grouping_columns, dtype=str, chunksize=chunksize)
+    partials = []
+    for chunk in reader:
+        partials.append(chunk.groupby(grouping_columns).size())
+        if len(partials) >= merge_every:
+            partials = [merge_counts(partials, grouping_columns)]
+
+    if not partials:
+        return None
+
+    grouped_data = merge_counts(partials, grouping_columns).reset_index(name='count')
+    grouped_data['count'] = grouped_data['count'].astype('int64')
+
+    # Give every part the same columns; ages become whole years, which can merge groups
+    grouped_data = grouped_data.reindex(columns=candidate_columns + ['count'])
+    # Ages that do not fit the int16 column (e.g. '99999' or '1e5') count as missing, like unparseable ones
+    ages = np.trunc(pd.to_numeric(grouped_data['subject_age'], errors='coerce'))
+    age_range = np.iinfo(np.int16)
+    grouped_data['subject_age'] = ages.where(ages.between(age_range.min, age_range.max))
+    grouped_data = (
+        grouped_data.groupby(candidate_columns, dropna=False)['count'].sum()
+        .reset_index()
+        .sort_values(['subject_race', 'subject_sex', 'subject_age', 'violation'])
+    )
+    grouped_data['subject_age'] = grouped_data['subject_age'].astype('Int16')
+    return grouped_data
+
+
+def to_arrow_table(grouped_data):
+    # Build the part with an explicit schema so every state's parts read back as one dataset
+    arrays = [pa.array(grouped_data['subject_age'], type=pa.int16())]
+    for column in categorical_columns:
+        arrays.append(pa.array(grouped_data[column], type=pa.string(), from_pandas=True).dictionary_encode())
+    arrays.append(pa.array(grouped_data['count'], type=pa.int64()))
+    return pa.Table.from_arrays(arrays, schema=part_schema)
+
+
+def ingest_state_file(file, output_path=output_path, chunksize=chunk_size, entry=None):
+    """
+    Aggregate one state file and write it to its partition of the Parquet dataset.
+    Runs inside a worker process, so only the new manifest record and row count are
+    returned. If the file was touched but its content hash matches the previous
+    manifest entry, the existing partition is kept and only the record is refreshed.
+    """
+    signature = file_signature(file)
+    content_hash = file_hash(file)
+    part_file = partition_file(file, output_path)
+    record = dict(signature, sha256=content_hash, part=os.path.basename(part_file), format=part_format)
+
+    if entry is not None and entry.get('sha256') == content_hash and entry.get('part') == record['part'] \
+            and entry.get('format') == part_format and os.path.exists(part_file):
+        return record, None
+
+    grouped_data = aggregate_state_file(file, chunksize=chunksize)
+    if grouped_data is None:
+        # Remember files with nothing to aggregate so they are not re-read next time
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        return dict(record, part=None), 0
+
+    os.makedirs(os.path.dirname(part_file), exist_ok=True)
+
+    # Write to a hidden temporary file first so readers never see a half-written part
+    tmp_file = os.path.join(os.path.dirname(part_file), '.' + os.path.basename(part_file) + '.tmp')
+    pq.write_table(to_arrow_table(grouped_data), tmp_file)
+    os.replace(tmp_file, part_file)
+    return record, len(grouped_data)
+
+
+def ingest_folder(folder_path=folder_path, output_path=output_path, chunksize=chunk_size,
+                  max_workers=max_workers, force=False):
+    """
+    Aggregate the state CSVs in folder_path in a process pool and write the
+    results as a Parquet dataset partitioned by state. Files whose size and
+    mtime match the manifest are skipped unless force is set, and partitions
+    whose source file has disappeared, or that no manifest lists, are removed.
+    A file that fails to ingest is reported and keeps its previous partition
+    and manifest record, so it is tried again next run; the other files'
+    results are still saved. Returns the states whose partitions were
+    rebuilt or removed.
+    """
+    files = sorted(glob.glob(os.path.join(folder_path, "*.csv")))
+    os.makedirs(output_path, exist_ok=True)
+    manifests = load_manifests(output_path)
+
+    # Drop partitions whose source file is gone
+    current = {(state_from_filename(file), os.path.basename(file)) for file in files}
+    changed_states = set()
+    for state, entries in manifests.items():
+        for name in list(entries):
+            if (state, name) not in current:
+                stale_part = entries.pop(name).get('part')
+                if stale_part and os.path.exists(os.path.join(output_path, f"state={state}", stale_part)):
+                    os.remove(os.path.join(output_path, f"state={state}", stale_part))
+                print(f"{name}: source removed, partition dropped")
+                changed_states.add(state)
+    rebuilt_states = set(changed_states)
+
+    pending = []
+    for file in files:
+        entry = manifests.get(state_from_filename(file), {}).get(os.path.basename(file))
+        if not force and is_unchanged(file, entry, output_path):
+            continue
+        pending.append((file, None if force else entry))
+    print(f"{len(files) - len(pending)} unchanged, {len(pending)} to check")
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(ingest_state_file, file, output_path, chunksize, entry): file
+            for file, entry in pending
+        }
+        for future in as_completed(futures):
+            file = futures[future]
+            state, name = state_from_filename(file), os.path.basename(file)
+            try:
+                record, rows = future.result()
+            except Exception as e:
+                print(f"{name}: failed, previous partition kept ({e!r})")
+                failed.append(name)
+                continue
+            manifests.setdefault(state, {})[name] = record
+            changed_states.add(state)
+
+            if rows is None:
+                print(f"{name}: content unchanged")
+            else:
+                print(f"{name}: {rows} groups")
+                rebuilt_states.add(state)
+
+    # Manifests are only written here, so workers never race on the same file
+    for state in changed_states:
+        save_manifest(state, manifests.get(state, {}), output_path)
+    if failed:
+        print(f"{len(failed)} files failed to ingest: {', '.join(sorted(failed))}")
+
+    # Parts no manifest lists (e.g. written by raw_query.export_aggregated_data) would be double counted
+    rebuilt_states.update(remove_unlisted_parts(manifests, output_path))
 
-    # Load the CSV file
-    state_data = pd.read_csv(file)
+    return sorted(rebuilt_states)
 
-    print(state_data.columns)
 
-    grouping_columns = []
-    if 'subject_age' in state_data.columns:
-        grouping_columns.append('subject_age')
-    if 'subject_sex' in state_data.columns:
-        grouping_columns.append('subject_sex')
-    if 'subject_race' in state_data.columns:
-        grouping_columns.append('subject_race')
-    if 'violation' in state_data.columns:
-        grouping_columns.append('violation')
+def remove_unlisted_parts(manifests, output_path=output_path):
+    """
+    Delete Parquet files in the state partitions that the manifests do not
+    list, so the dataset only holds the parts of the current ingest.
+    Returns the states that had any.
+    """
+    states = set()
+    for state_dir in glob.glob(os.path.join(output_path, "state=*")):
+        state = os.path.basename(state_dir).split('=', 1)[1]
+        listed = {entry.get('part') for entry in manifests.get(state, {}).values()}
+        for part in glob.glob(os.path.join(state_dir, "*.parquet")):
+            if os.path.basename(part) not in listed:
+                os.remove(part)
+                print(f"{os.path.basename(part)}: not in the {state} manifest, removed")
+                states.add(state)
+    return states
 
-    # Group by age, race, and sex to get the count of each combination
-    grouped_data = state_data.groupby(grouping_columns).size().reset_index(name='count')
 
-    # Add a new column for the state based on the filename
-    grouped_data['state'] = state_abbr
+def export_csv(output_path=output_path, output_file=output_file):
+    # Flatten the partitioned dataset into the single CSV the older tools expect
+    all_data = pd.read_parquet(output_path)
+    all_data['state'] = all_data['state'].astype(str)
+    all_data.to_csv(output_file, index=False)
+    return all_data
 
 
-    # Append the grouped data to the all_data DataFrame
-    all_data = pd.concat([all_data, grouped_data], ignore_index=True)
+def main():
+    rebuilt = ingest_folder()
+    print(f"Rebuilt partitions for {len(rebuilt)} states in {output_path}: {', '.join(rebuilt)}")
 
-# Check columns in the combined DataFrame
-print("Columns in combined DataFrame:", all_data.columns)
+    if output_file and (rebuilt or not os.path.exists(output_file)):
+        all_data = export_csv()
+        # Check columns in the combined DataFrame
+        print("Columns in combined DataFrame:", all_data.columns)
+        print(f"Aggregated data saved to {output_file}")
 
-# Save the aggregated data to a new CSV file
-output_file = '/Users/sarvy/Desktop/OpenPolicing/aggregated_data.csv'  # Update with your desired output file path
-all_data.to_csv(output_file, index=False)
 
-print(f"Aggregated data saved to {output_file}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import glob
+import os
+import shutil
+import sys
+import time
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from directory_swap import replace_directory, swap_lock
+from moveDataset import candidate_columns, detect_grouping_columns, folder_path, output_path, state_from_filename
+
+# Worker threads DuckDB may use per query (None = one per CPU)
+threads = None
+
+# Memory DuckDB may use before it spills to temp_directory, e.g. '8GB' (None = DuckDB's default)
+memory_limit = None
+
+# Where large aggregations spill when they do not fit in memory_limit
+temp_directory = '.duckdb_tmp'
+
+# Columns of the raw stop files the aggregations can group and filter on
+stop_columns = ['state'] + candidate_columns
+
+
+def connect(threads=threads, memory_limit=memory_limit, temp_directory=temp_directory):
+    """
+    An in-process DuckDB connection for querying the raw state files. Scans
+    run on several threads and spill to temp_directory instead of failing
+    when an aggregation does not fit in memory.
+    """
+    if duckdb is None:
+        raise ImportError("raw_query needs the duckdb package (pip install duckdb)")
+    connection = duckdb.connect()
+    if threads:
+        connection.execute(f"SET threads = {int(threads)}")
+    if memory_limit:
+        connection.execute(f"SET memory_limit = '{memory_limit}'")
+    if temp_directory:
+        connection.execute(f"SET temp_directory = '{temp_directory}'")
+    return connection
+
+
+@lru_cache(maxsize=None)
+def shared_connection():
+    # One connection per process; each query runs on its own cursor, so threads can share it
+    return connect()
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Strings pandas.read_csv reads as NaN by default, so moveDataset.py never counts them
+pandas_null_strings = ", ".join(sql_string(value) for value in [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+
+def raw_sources(folder=folder_path):
+    """
+    DuckDB table functions over the state files in folder, one per (state,
+    columns present) group, paired with that state and the candidate columns
+    its files have. Like moveDataset.py, CSV columns are read as text and the
+    state comes from the file name.
+    """
+    groups = {}
+    for file in sorted(glob.glob(os.path.join(folder, "*.csv"))):
+        key = ('csv', state_from_filename(file), tuple(detect_grouping_columns(file)))
+        groups.setdefault(key, []).append(file)
+    for file in sorted(glob.glob(os.path.join(folder, "*.parquet"))):
+        names = pq.read_schema(file).names
+        key = ('parquet', state_from_filename(file), tuple(c for c in candidate_columns if c in names))
+        groups.setdefault(key, []).append(file)
+    if not groups:
+        raise FileNotFoundError(f"No state CSV or Parquet files in {folder}")
+
+    sources = []
+    for (kind, state, present), files in groups.items():
+        file_list = "[" + ", ".join(sql_string(file) for file in files) + "]"
+        if kind == 'csv':
+            source = f"read_csv_auto({file_list}, all_varchar = true, union_by_name = true)"
+        else:
+            source = f"read_parquet({file_list}, union_by_name = true)"
+        sources.append((source, state, list(present)))
+    return sources
+
+
+def raw_stops_sql(folder=folder_path):
+    """
+    SQL for one row per raw stop across every state file in folder, counted
+    the way moveDataset.py counts them: rows with a missing value in any
+    grouping column the file has are left out, and ages become whole years
+    (unparseable ages, and ages outside the int16 range, stay as a missing
+    age). Columns a file does not have are NULL.
+    """
+    selects = []
+    for source, state, present in raw_sources(folder):
+        if not present:
+            # moveDataset skips files with no grouping column at all
+            continue
+        column = {}
+        for name in candidate_columns:
+            if name not in present:
+                column[name] = "NULL"
+            else:
+                # Treat pandas' default NA strings ('NA', 'NaN', ...) as missing, as read_csv does
+                column[name] = f"CASE WHEN CAST({name} AS VARCHAR) IN ({pandas_null_strings}) THEN NULL ELSE {name} END"
+        not_missing = " AND ".join(f"({column[name]}) IS NOT NULL" for name in present)
+        selects.append(
+            f"SELECT {sql_string(state)} AS state, "
+            f"TRY_CAST(trunc(TRY_CAST({column['subject_age']} AS DOUBLE)) AS SMALLINT) AS subject_age, "
+            f"CAST({column['subject_sex']} AS VARCHAR) AS subject_sex, "
+            f"CAST({column['subject_race']} AS VARCHAR) AS subject_race, "
+            f"CAST({column['violation']} AS VARCHAR) AS violation FROM {source} WHERE {not_missing}"
+        )
+    if not selects:
+        raise FileNotFoundError(f"No state files in {folder} have any of {candidate_columns}")
+    return " UNION ALL ".join(selects)
+
+
+def where_clause(states=None, filters=None):
+    # filters maps a column to one value or a list of values; returns (sql, parameters)
+    conditions, parameters = [], []
+    filters = dict(filters or {})
+    if states is not None:
+        filters['state'] = [str(state).upper() for state in states]
+    for column, value in filters.items():
+        if column not in stop_columns:
+            raise ValueError(f"Unknown column {column!r}; expected one of {stop_columns}")
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        parameters.extend(values)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+
+def aggregate(group_by=stop_columns, folder=folder_path, states=None, connection=None, **filters):
+    """
+    Count raw stops per combination of the group_by columns, straight from
+    the state files, e.g. aggregate(['violation', 'subject_race'], states=['GA'])
+    or aggregate(['state'], subject_sex='female'). Keyword filters take a
+    value or a list of values.
+    """
+    group_by = list(group_by)
+    for column in group_by:
+        if column not in stop_columns:
+            raise ValueError(f"Unknown column {column!r}; expected one of {stop_columns}")
+    where, parameters = where_clause(states, filters)
+    columns = ", ".join(group_by)
+    cursor = (connection or shared_connection()).cursor()
+    try:
+        query = f"SELECT {columns + ', ' if columns else ''}count(*) AS count FROM ({raw_stops_sql(folder)}){where}"
+        if columns:
+            query += f" GROUP BY {columns} ORDER BY {columns}"
+        return cursor.execute(query, parameters).df()
+    finally:
+        cursor.close()
+
+
+def crosstab(rows, columns, folder=folder_path, states=None, connection=None, **filters):
+    """
+    Stop counts with one row per value of `rows` and one column per value of
+    `columns`, e.g. crosstab('violation', 'subject_race', states=['GA']).
+    """
+    counts = aggregate([rows, columns], folder, states, connection, **filters)
+    return counts.pivot_table(index=rows, columns=columns, values='count', aggfunc='sum', fill_value=0)
+
+
+def export_aggregated_data(folder=folder_path, output_path=output_path, connection=None):
+    """
+    Rebuild the whole state-partitioned aggregated_data dataset from the raw
+    files in one out-of-core DuckDB pass, as an alternative to the pandas
+    ingest in moveDataset.py with the same totals. The new dataset is
+    written beside the old one and swapped in; the old one is kept if the
+    export fails. It has no ingest manifests, so the next moveDataset.py run
+    rebuilds every state and deletes the parts written here.
+    """
+    started = time.time()
+    columns = ", ".join(stop_columns)
+    with swap_lock(output_path):
+        tmp_path = f"{output_path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        cursor = (connection or shared_connection()).cursor()
+        try:
+            cursor.execute(
+                f"COPY (SELECT {columns}, CAST(count(*) AS BIGINT) AS count FROM ({raw_stops_sql(folder)}) "
+                f"GROUP BY {columns} ORDER BY state, subject_race, subject_sex, subject_age, violation) "
+                f"TO {sql_string(tmp_path)} (FORMAT PARQUET, PARTITION_BY (state))"
+            )
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        finally:
+            cursor.close()
+        replace_directory(tmp_path, output_path)
+    print(f"Aggregated {folder} into {output_path} in {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    # python raw_query.py export [folder] [output_path]
+    # python raw_query.py slice STATE ROW_COLUMN COLUMN_COLUMN [folder]
+    usage = ("Usage: python raw_query.py export [folder] [output_path]\n"
+             "       python raw_query.py slice STATE ROW_COLUMN COLUMN_COLUMN [folder]")
+    if len(sys.argv) >= 2 and sys.argv[1] == 'export':
+        export_aggregated_data(*sys.argv[2:4])
+    elif len(sys.argv) >= 5 and sys.argv[1] == 'slice':
+        state, rows, columns = sys.argv[2:5]
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(crosstab(rows, columns, *sys.argv[5:6], states=[state]))
+    else:
+        print(usage)
+        sys.exit(1)
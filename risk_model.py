@@ -0,0 +1,588 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+from directory_swap import replace_directory, swap_lock
+
+# Geocoded stops the model is trained on
+data_path = 'output.csv'
+
+# Directory holding the serialized model
+model_dir = 'risk_model'
+
+# Bump when the on-disk layout changes; older artifacts are rebuilt
+model_format = 2
+
+num_clusters = 100
+
+# Stops processed per pass when computing risk weights, bounding the temporaries
+weight_chunk_size = 1_000_000
+
+# Stops read from data_path at a time by the streaming trainer
+stream_chunk_size = 500_000
+
+# Mini-batch size for MiniBatchKMeans in the streaming trainer (at least num_clusters)
+mini_batch_size = 4096
+
+# Passes the streaming trainer makes over data_path while clustering
+stream_epochs = 3
+
+# Passes over the new stops when an update refines the saved zones
+update_epochs = 1
+
+
+class ZoneLocator:
+    """
+    Nearest risk zone lookup over the scaled lat/lng space, built from the
+    zone centroids. Uses a KD-tree when scipy is available, so queries stay
+    fast with thousands of zones, and a chunked brute-force search otherwise.
+    """
+
+    def __init__(self, centroids, chunk_size=65536):
+        self.centroids = np.ascontiguousarray(centroids, dtype=float)
+        self.chunk_size = chunk_size
+        self.tree = cKDTree(self.centroids) if cKDTree is not None else None
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+
+    def nearest(self, points_scaled):
+        points_scaled = np.asarray(points_scaled, dtype=float).reshape(-1, 2)
+        if self.tree is not None:
+            _, zones = self.tree.query(points_scaled, k=1)
+            return zones.astype(np.int64, copy=False)
+
+        zones = np.empty(len(points_scaled), dtype=np.int64)
+        for start in range(0, len(points_scaled), self.chunk_size):
+            chunk = points_scaled[start:start + self.chunk_size]
+            # |p - c|^2 without the |p|^2 term, which is the same for every centroid
+            distances = self._centroid_norms[None, :] - 2 * chunk @ self.centroids.T
+            zones[start:start + self.chunk_size] = distances.argmin(axis=1)
+        return zones
+
+
+class RiskModel:
+    """
+    Everything scoring needs from the fitted risk zones: the lat/lng scaler,
+    the zone centroids and the general and demographic risk tables. Saved as
+    a directory of .npy files so it can be memory-mapped back in milliseconds.
+
+    Race and sex are encoded as small ints (their position in `races` and
+    `sexes`) and the demographic risk is a dense zones x races x sexes float32
+    array. The extra last race and sex slot is all zeros and stands for any
+    value the model has not seen (including None).
+    """
+
+    def __init__(self, scale_min, scale, centroids, general_risk,
+                 races, sexes, demographic_risk, version=None, meta=None):
+        self.scale_min = scale_min
+        self.scale = scale
+        self.centroids = centroids
+        self.general_risk = general_risk
+        self.races = races
+        self.sexes = sexes
+        self.demographic_risk = demographic_risk
+        self.version = version or self._fingerprint()
+        self.meta = meta or {}
+        self.locator = ZoneLocator(centroids)
+        self._race_codes = {race: i for i, race in enumerate(races.tolist())}
+        self._sex_codes = {sex: i for i, sex in enumerate(sexes.tolist())}
+
+    def _arrays(self):
+        return {
+            'scale_min': self.scale_min,
+            'scale': self.scale,
+            'centroids': self.centroids,
+            'general_risk': self.general_risk,
+            'races': self.races,
+            'sexes': self.sexes,
+            'demographic_risk': self.demographic_risk,
+        }
+
+    def _fingerprint(self):
+        # Content hash, so every worker can tell it scores against the same model
+        digest = hashlib.sha256()
+        for name, array in sorted(self._arrays().items()):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:16]
+
+    def transform(self, points):
+        """
+        Scale (lat, lng) points the way the fitted MinMaxScaler did.
+        """
+        return np.asarray(points, dtype=float) * self.scale + self.scale_min
+
+    def assign_zones(self, points_scaled):
+        """
+        Nearest centroid for each scaled point (what KMeans.predict returns).
+        """
+        return self.locator.nearest(points_scaled)
+
+    def general_scores(self, zones):
+        return self.general_risk[zones]
+
+    def encode_races(self, races):
+        # Unseen races (and None) map to the all-zero slot
+        return np.array([self._race_codes.get(race, len(self._race_codes)) for race in races], dtype=np.int64)
+
+    def encode_sexes(self, sexes):
+        return np.array([self._sex_codes.get(sex, len(self._sex_codes)) for sex in sexes], dtype=np.int64)
+
+    def demographic_scores(self, zones, race_codes, sex_codes):
+        """
+        Demographic risk for many points at once from encoded race/sex codes.
+        """
+        return np.asarray(self.demographic_risk[zones, race_codes, sex_codes], dtype=float)
+
+    def demographic_score(self, zone, race, sex):
+        return float(self.demographic_risk[zone, self.encode_races([race])[0], self.encode_sexes([sex])[0]])
+
+    def save(self, model_dir=model_dir):
+        """
+        Write the model to model_dir, replacing any previous version in one
+        step. Run it under build_lock so only one process swaps at a time.
+        """
+        tmp_dir = f"{model_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, array in self._arrays().items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array, allow_pickle=False)
+        meta = dict(self.meta, format=model_format, version=self.version)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        replace_directory(tmp_dir, model_dir)
+
+    @classmethod
+    def _read(cls, model_dir, mmap):
+        with open(os.path.join(model_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != model_format:
+            raise ValueError(f"Risk model in {model_dir} has format {meta.get('format')}, expected {model_format}.")
+        mmap_mode = 'r' if mmap else None
+        arrays = {
+            name: np.load(os.path.join(model_dir, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+            for name in ['scale_min', 'scale', 'centroids', 'general_risk', 'races', 'sexes', 'demographic_risk']
+        }
+        return cls(version=meta['version'], meta=meta, **arrays)
+
+    @classmethod
+    def load(cls, model_dir=model_dir, mmap=True, locked=False):
+        """
+        Load a saved model. With mmap the arrays are memory-mapped, so worker
+        processes share the page-cached files instead of holding copies.
+
+        meta.json and the arrays are separate files, so a save swapped in
+        between the reads would pair one version's meta with the other's
+        arrays. The arrays are checked against meta's version, and on a
+        mismatch read again under build_lock, which every save holds.
+        locked says the caller already holds it.
+        """
+        model = cls._read(model_dir, mmap)
+        if model._fingerprint() == model.version:
+            return model
+        if not locked:
+            with build_lock(model_dir):
+                model = cls._read(model_dir, mmap)
+            if model._fingerprint() == model.version:
+                return model
+        raise ValueError(f"Risk model arrays in {model_dir} do not match version {model.version} in its meta.json.")
+
+
+def find_high_risk_zones(labels, num_clusters=num_clusters):
+    """
+    Zones whose stop count is in the top 20% of the zones that have stops.
+    """
+    zone_counts = np.bincount(labels, minlength=num_clusters)
+    occupied = zone_counts[zone_counts > 0]
+    if len(occupied) == 0:
+        return np.zeros(num_clusters, dtype=bool)
+    return zone_counts >= np.quantile(occupied, 0.8)
+
+
+def raw_risk_weights(coords_scaled, labels, centroids, high_risk, chunk_size=weight_chunk_size):
+    """
+    Unnormalised risk weight of every stop in one pass over the rows: 0.5,
+    plus exp(-distance to its own zone centroid) if that zone is high-risk.
+    Rows are handled chunk_size at a time so the temporaries stay small.
+    """
+    weights = np.full(len(labels), 0.5)
+    for start in range(0, len(labels), chunk_size):
+        rows = slice(start, start + chunk_size)
+        zones = labels[rows]
+        distance = np.linalg.norm(coords_scaled[rows] - centroids[zones], axis=1)
+        weights[rows] += np.where(high_risk[zones], np.exp(-distance), 0.0)
+    return weights
+
+
+def normalize_weights(weights):
+    # Min-max scale to [0, 1] in place; a constant column becomes all zeros, as with MinMaxScaler
+    low, high = weights.min(), weights.max()
+    weights -= low
+    if high > low:
+        weights /= high - low
+    return weights
+
+
+def demographic_table(demographic, num_clusters):
+    """
+    Encode a (risk_zone, subject_race, subject_sex) -> risk Series as sorted
+    race/sex lists and a dense zones x races x sexes table. The extra last
+    race/sex slot stays zero for unseen values.
+    """
+    keys = demographic.index.to_frame(index=False)
+    races = np.array(sorted(keys['subject_race'].astype(str).unique()), dtype=str)
+    sexes = np.array(sorted(keys['subject_sex'].astype(str).unique()), dtype=str)
+    race_codes = pd.Categorical(keys['subject_race'].astype(str), categories=races).codes
+    sex_codes = pd.Categorical(keys['subject_sex'].astype(str), categories=sexes).codes
+    demographic_risk = np.zeros((num_clusters, len(races) + 1, len(sexes) + 1), dtype=np.float32)
+    demographic_risk[keys['risk_zone'].to_numpy(), race_codes, sex_codes] = demographic.to_numpy()
+    return races, sexes, demographic_risk
+
+
+def fit_risk_model(data_path=data_path, num_clusters=num_clusters):
+    """
+    Train the risk zones on the geocoded stops in data_path. This is the
+    slow, offline step; scoring only needs the RiskModel it returns.
+    """
+    # Only the build step needs scikit-learn
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import MinMaxScaler
+
+    started = time.time()
+
+    # Load and preprocess data
+    data = pd.read_csv(data_path)
+    data = data.dropna(subset=['lat', 'lng'])
+
+    # Clustering
+    coords = data[['lat', 'lng']]
+    scaler = MinMaxScaler()
+    coords_scaled = scaler.fit_transform(coords)
+    kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init=10)
+    labels = kmeans.fit_predict(coords_scaled)
+    data['risk_zone'] = labels
+
+    # Identify high-risk zones
+    high_risk = find_high_risk_zones(labels, num_clusters)
+    zone_centroids = kmeans.cluster_centers_
+
+    if not high_risk.any():
+        print("Warning: No high-risk zones dynamically identified. Defaulting to uniform risk weights.")
+
+    data['risk_weight'] = normalize_weights(raw_risk_weights(coords_scaled, labels, zone_centroids, high_risk))
+
+    # Prepare risk tables; zones without stops keep a risk of 0
+    zone_counts = np.bincount(labels, minlength=num_clusters)
+    zone_sums = np.bincount(labels, weights=data['risk_weight'].to_numpy(), minlength=num_clusters)
+    general_risk = np.divide(zone_sums, zone_counts, out=np.zeros(num_clusters), where=zone_counts > 0)
+
+    demographic = data.groupby(['risk_zone', 'subject_race', 'subject_sex'])['risk_weight'].mean()
+    races, sexes, demographic_risk = demographic_table(demographic, num_clusters)
+
+    return RiskModel(
+        scale_min=scaler.min_,
+        scale=scaler.scale_,
+        centroids=zone_centroids,
+        general_risk=general_risk,
+        races=races,
+        sexes=sexes,
+        demographic_risk=demographic_risk,
+        meta={
+            'data_path': data_path,
+            'rows': int(len(data)),
+            'num_clusters': num_clusters,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'build_seconds': round(time.time() - started, 2),
+        },
+    )
+
+
+def stream_stops(data_path, chunk_size=stream_chunk_size, demographics=False):
+    # Geocoded stops in chunks, without rows that are missing a location
+    columns = ['lat', 'lng'] + (['subject_race', 'subject_sex'] if demographics else [])
+    for chunk in pd.read_csv(data_path, usecols=columns, chunksize=chunk_size):
+        yield chunk.dropna(subset=['lat', 'lng'])
+
+
+def fit_minibatch(chunks, num_clusters=num_clusters, batch_size=mini_batch_size, init=None):
+    """
+    MiniBatchKMeans over an iterable of scaled coordinate chunks, with one
+    partial_fit per batch_size rows (partial_fit itself ignores batch_size).
+    init continues from the given centroids instead of k-means++.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    if init is not None:
+        kmeans = MiniBatchKMeans(n_clusters=num_clusters, init=np.asarray(init), n_init=1,
+                                 batch_size=batch_size, random_state=42)
+    else:
+        kmeans = MiniBatchKMeans(n_clusters=num_clusters, n_init=3, batch_size=batch_size, random_state=42)
+
+    pending = np.empty((0, 2))
+    for chunk in chunks:
+        # Rows that do not fill a whole batch are carried over to the next chunk
+        rows = np.concatenate([pending, chunk]) if len(pending) else chunk
+        full = len(rows) // batch_size * batch_size
+        for start in range(0, full, batch_size):
+            kmeans.partial_fit(rows[start:start + batch_size])
+        pending = rows[full:]
+    if len(pending) and (hasattr(kmeans, 'cluster_centers_') or len(pending) >= num_clusters):
+        kmeans.partial_fit(pending)
+    if not hasattr(kmeans, 'cluster_centers_'):
+        raise ValueError(f"Need at least {num_clusters} geocoded stops to fit {num_clusters} zones.")
+    return kmeans
+
+
+def fit_risk_model_streaming(data_path=data_path, num_clusters=num_clusters, chunk_size=stream_chunk_size,
+                             warm_start=None, batch_size=mini_batch_size, epochs=stream_epochs, cluster_path=None):
+    """
+    Train the risk zones without loading data_path into memory: coordinates
+    are streamed in chunks into MiniBatchKMeans, and the risk tables are
+    built from running per-zone sums.
+
+    data_path is every stop the risk tables should cover. The zones are
+    fitted on cluster_path, which defaults to data_path. With warm_start (a
+    previous RiskModel), its scaler is kept and training continues from its
+    centroids, so a monthly refresh passes only the new month as
+    cluster_path (with fewer epochs) to nudge the existing zones, while
+    data_path stays the cumulative file. Zone ids stay comparable between
+    versions.
+    """
+    started = time.time()
+    cluster_path = cluster_path or data_path
+
+    # Pass 1 (data_path): lat/lng range for the scaler (kept from the previous model on a warm start)
+    if warm_start is not None:
+        scale_min = np.asarray(warm_start.scale_min, dtype=float)
+        scale = np.asarray(warm_start.scale, dtype=float)
+    else:
+        low, high = np.full(2, np.inf), np.full(2, -np.inf)
+        for chunk in stream_stops(data_path, chunk_size):
+            if len(chunk):
+                coords = chunk[['lat', 'lng']].to_numpy(dtype=float)
+                low, high = np.minimum(low, coords.min(axis=0)), np.maximum(high, coords.max(axis=0))
+        data_range = np.where(high > low, high - low, 1.0)
+        scale = 1.0 / data_range
+        scale_min = -low * scale
+
+    # Pass 2 (cluster_path): mini-batch clustering, epochs passes over the file
+    chunks = (
+        chunk[['lat', 'lng']].to_numpy(dtype=float) * scale + scale_min
+        for _ in range(epochs)
+        for chunk in stream_stops(cluster_path, chunk_size)
+    )
+    kmeans = fit_minibatch(chunks, num_clusters, batch_size,
+                           init=warm_start.centroids if warm_start is not None else None)
+    centroids = kmeans.cluster_centers_
+    locator = ZoneLocator(centroids)
+    fit_seconds = time.time() - started
+
+    # Pass 3 (data_path): a stop's raw weight is 0.5, plus its proximity exp(-distance
+    # to its centroid) if its zone is high-risk. Which zones are high-risk depends on
+    # every zone's size, so the pass keeps per-zone and per-(zone, race, sex) sums of
+    # the proximity and applies the high-risk zones afterwards.
+    zone_counts = np.zeros(num_clusters, dtype=np.int64)
+    proximity_sums = np.zeros(num_clusters)
+    proximity_low = np.full(num_clusters, np.inf)
+    proximity_high = np.full(num_clusters, -np.inf)
+    demographic_sums = None
+    for chunk in stream_stops(data_path, chunk_size, demographics=True):
+        coords_scaled = chunk[['lat', 'lng']].to_numpy(dtype=float) * scale + scale_min
+        labels = locator.nearest(coords_scaled)
+        proximity = np.exp(-np.linalg.norm(coords_scaled - centroids[labels], axis=1))
+        zone_counts += np.bincount(labels, minlength=num_clusters)
+        proximity_sums += np.bincount(labels, weights=proximity, minlength=num_clusters)
+        np.minimum.at(proximity_low, labels, proximity)
+        np.maximum.at(proximity_high, labels, proximity)
+
+        partial = pd.DataFrame({
+            'risk_zone': labels,
+            'subject_race': chunk['subject_race'].to_numpy(),
+            'subject_sex': chunk['subject_sex'].to_numpy(),
+            'proximity': proximity,
+        }).groupby(['risk_zone', 'subject_race', 'subject_sex'])['proximity'].agg(['sum', 'count'])
+        demographic_sums = partial if demographic_sums is None else demographic_sums.add(partial, fill_value=0)
+
+    occupied = zone_counts > 0
+    high_risk = zone_counts >= np.quantile(zone_counts[occupied], 0.8) if occupied.any() else occupied
+    if not high_risk.any():
+        print("Warning: No high-risk zones dynamically identified. Defaulting to uniform risk weights.")
+
+    # Min-max normalisation is affine, so normalising the means afterwards gives
+    # the same tables as normalising every stop's weight first
+    if occupied.any():
+        low_weight = np.where(high_risk, 0.5 + proximity_low, 0.5)[occupied].min()
+        high_weight = np.where(high_risk, 0.5 + proximity_high, 0.5)[occupied].max()
+    else:
+        low_weight = high_weight = 0.5
+    weight_range = high_weight - low_weight if high_weight > low_weight else 1.0
+    mean_proximity = np.divide(proximity_sums, zone_counts, out=np.zeros(num_clusters), where=occupied)
+    zone_means = 0.5 + np.where(high_risk, mean_proximity, 0.0)
+    general_risk = np.where(occupied, (zone_means - low_weight) / weight_range, 0.0)
+
+    if demographic_sums is None:
+        demographic = pd.Series(dtype=float, index=pd.MultiIndex.from_arrays(
+            [[], [], []], names=['risk_zone', 'subject_race', 'subject_sex']))
+    else:
+        zones = demographic_sums.index.get_level_values('risk_zone').to_numpy()
+        means = 0.5 + np.where(high_risk[zones], demographic_sums['sum'] / demographic_sums['count'], 0.0)
+        demographic = pd.Series((means - low_weight) / weight_range, index=demographic_sums.index)
+    races, sexes, demographic_risk = demographic_table(demographic, num_clusters)
+
+    return RiskModel(
+        scale_min=scale_min,
+        scale=scale,
+        centroids=centroids,
+        general_risk=general_risk,
+        races=races,
+        sexes=sexes,
+        demographic_risk=demographic_risk,
+        meta={
+            'data_path': data_path,
+            'cluster_path': cluster_path,
+            'rows': int(zone_counts.sum()),
+            'num_clusters': num_clusters,
+            'trainer': 'minibatch',
+            'batch_size': batch_size,
+            'epochs': epochs,
+            'warm_start_from': warm_start.version if warm_start is not None else None,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'fit_seconds': round(fit_seconds, 2),
+            'build_seconds': round(time.time() - started, 2),
+        },
+    )
+
+
+def compare_trainers(data_path=data_path, num_clusters=num_clusters, sample_size=200_000, chunk_size=stream_chunk_size,
+                     batch_size=mini_batch_size, epochs=stream_epochs):
+    """
+    Fit the full-batch KMeans and the streaming trainer (fit_minibatch with
+    the same chunking, batches and epochs as build-streaming) on the same
+    sample and report training time, inertia (mean squared distance of a
+    stop to its centroid, lower is better) and how often the two put a stop
+    in corresponding zones (adjusted Rand index, 1.0 is identical).
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import adjusted_rand_score
+
+    coords = pd.read_csv(data_path, usecols=['lat', 'lng']).dropna()
+    if len(coords) > sample_size:
+        coords = coords.sample(sample_size, random_state=42)
+    coords = coords.to_numpy(dtype=float)
+    low, high = coords.min(axis=0), coords.max(axis=0)
+    coords_scaled = (coords - low) / np.where(high > low, high - low, 1.0)
+
+    started = time.time()
+    full = KMeans(n_clusters=num_clusters, random_state=42, n_init=10).fit(coords_scaled)
+    full_seconds = time.time() - started
+
+    started = time.time()
+    chunks = (
+        coords_scaled[start:start + chunk_size]
+        for _ in range(epochs)
+        for start in range(0, len(coords_scaled), chunk_size)
+    )
+    mini = fit_minibatch(chunks, num_clusters, batch_size)
+    mini_seconds = time.time() - started
+    mini_labels = ZoneLocator(mini.cluster_centers_).nearest(coords_scaled)
+    mini_inertia = ((coords_scaled - mini.cluster_centers_[mini_labels]) ** 2).sum()
+
+    report = {
+        'stops': int(len(coords_scaled)),
+        'full_batch_seconds': round(full_seconds, 2),
+        'minibatch_seconds': round(mini_seconds, 2),
+        'full_batch_inertia': float(full.inertia_ / len(coords_scaled)),
+        'minibatch_inertia': float(mini_inertia / len(coords_scaled)),
+        'adjusted_rand_index': float(adjusted_rand_score(full.labels_, mini_labels)),
+    }
+    report['inertia_ratio'] = report['minibatch_inertia'] / report['full_batch_inertia'] if report['full_batch_inertia'] else 1.0
+    return report
+
+
+def build_lock(model_dir=model_dir):
+    # Only one process (e.g. one gunicorn worker) builds or swaps the model at a time
+    return swap_lock(model_dir)
+
+
+def _build(data_path, model_dir, num_clusters, streaming, warm_start, new_data_path=None):
+    if streaming:
+        previous = RiskModel.load(model_dir, locked=True) if warm_start and os.path.exists(model_dir) else None
+        if previous is not None:
+            model = fit_risk_model_streaming(data_path, num_clusters, warm_start=previous,
+                                             epochs=update_epochs, cluster_path=new_data_path)
+        else:
+            model = fit_risk_model_streaming(data_path, num_clusters)
+    else:
+        model = fit_risk_model(data_path, num_clusters)
+    model.save(model_dir)
+    print(f"Risk model {model.version} built from {model.meta['rows']} stops "
+          f"in {model.meta['build_seconds']}s and saved to {model_dir}")
+    return model
+
+
+def build(data_path=data_path, model_dir=model_dir, num_clusters=num_clusters, streaming=False, warm_start=False,
+          new_data_path=None):
+    """
+    Fit and save the model. streaming uses the chunked MiniBatchKMeans
+    trainer. warm_start (streaming only) continues from the saved model: its
+    zones are refined on new_data_path alone (the stops added since, e.g. the
+    latest month; defaults to data_path) for update_epochs passes. data_path
+    must still hold every stop, because the risk tables are rebuilt from it.
+    Without a saved model, warm_start trains from scratch on data_path.
+    """
+    with build_lock(model_dir):
+        return _build(data_path, model_dir, num_clusters, streaming, warm_start, new_data_path)
+
+
+def load_or_build(data_path=data_path, model_dir=model_dir):
+    """
+    Load the saved model, building it first if there is none yet (or it was
+    written in an older format). When several workers start without a model,
+    one builds it and the rest wait for it and load it. A load that fails
+    while another process is swapping in a new model waits for it the same way.
+    """
+    try:
+        return RiskModel.load(model_dir)
+    except (FileNotFoundError, ValueError):
+        pass
+    with build_lock(model_dir):
+        try:
+            return RiskModel.load(model_dir, locked=True)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Building risk model: {e}")
+            return _build(data_path, model_dir, num_clusters, False, False)
+
+
+if __name__ == "__main__":
+    # python risk_model.py build|build-streaming|compare [data_path] [model_dir]
+    # python risk_model.py update new_data_path [data_path] [model_dir]
+    usage = ("Usage: python risk_model.py build|build-streaming|compare [data_path] [model_dir]\n"
+             "       python risk_model.py update new_data_path [data_path] [model_dir]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+    command, args = sys.argv[1], sys.argv[2:4]
+    if command == 'build':
+        build(*args)
+    elif command == 'build-streaming':
+        build(*args, streaming=True)
+    elif command == 'update' and len(sys.argv) >= 3:
+        # Monthly refresh: refine the saved zones on the new stops only, then rebuild
+        # the risk tables from the cumulative data_path (which includes the new stops)
+        build(*sys.argv[3:5], streaming=True, warm_start=True, new_data_path=sys.argv[2])
+    elif command == 'compare':
+        for name, value in compare_trainers(*args[:1]).items():
+            print(f"{name}: {value}")
+    else:
+        print(usage)
+        sys.exit(1)
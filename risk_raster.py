@@ -0,0 +1,191 @@
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from directory_swap import replace_directory, swap_lock
+from risk_model import RiskModel, model_dir
+
+# Directory holding the rasterized risk grids
+raster_dir = 'risk_raster'
+
+# Bump when the files in raster_dir change; rasters in another format must be rebuilt
+raster_format = 2
+
+# Grid cell size in degrees (about 500 m of latitude)
+cell_size = 0.005
+
+# Zone assignment is done this many grid rows at a time while building
+build_rows_per_chunk = 256
+
+
+class RiskRaster:
+    """
+    The risk zones of a RiskModel painted onto a regular lat/lng grid: one
+    int16 grid of zone ids, plus the model's small per-zone general and
+    zones x races x sexes demographic tables. Looking up a point is integer
+    index math and two gathers, with no model at query time. The arrays are
+    memory-mapped, so worker processes share one page-cached copy.
+
+    As in the model, the last race and sex slot of the demographic table is
+    all zeros and stands for any value it has not seen (including None).
+    """
+
+    def __init__(self, zones, general_risk, demographic_risk, lat0, lng0, cell_size, races, sexes, meta=None):
+        self.zones = zones
+        self.general_risk = general_risk
+        self.demographic_risk = demographic_risk
+        self.lat0 = lat0
+        self.lng0 = lng0
+        self.cell_size = cell_size
+        self.races = {race: i for i, race in enumerate(races)}
+        self.sexes = {sex: i for i, sex in enumerate(sexes)}
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, raster_dir=raster_dir):
+        with open(os.path.join(raster_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != raster_format:
+            raise ValueError(f"Risk raster in {raster_dir} has format {meta.get('format')}, expected {raster_format}. "
+                             f"Rebuild it with python risk_raster.py build.")
+        return cls(
+            zones=np.load(os.path.join(raster_dir, 'zones.npy'), mmap_mode='r'),
+            general_risk=np.load(os.path.join(raster_dir, 'general_risk.npy'), mmap_mode='r'),
+            demographic_risk=np.load(os.path.join(raster_dir, 'demographic_risk.npy'), mmap_mode='r'),
+            lat0=meta['lat0'],
+            lng0=meta['lng0'],
+            cell_size=meta['cell_size'],
+            races=meta['races'],
+            sexes=meta['sexes'],
+            meta=meta,
+        )
+
+    @property
+    def model_version(self):
+        return self.meta.get('model_version')
+
+    def cells(self, points):
+        """
+        Grid (row, col) of each (lat, lng) point; points off the grid use the nearest edge cell.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        rows = np.floor((points[:, 0] - self.lat0) / self.cell_size).astype(np.int64)
+        cols = np.floor((points[:, 1] - self.lng0) / self.cell_size).astype(np.int64)
+        np.clip(rows, 0, self.zones.shape[0] - 1, out=rows)
+        np.clip(cols, 0, self.zones.shape[1] - 1, out=cols)
+        return rows, cols
+
+    def point_zones(self, points):
+        rows, cols = self.cells(points)
+        return np.asarray(self.zones[rows, cols], dtype=np.int64)
+
+    def general_scores(self, points):
+        return np.asarray(self.general_risk[self.point_zones(points)], dtype=float)
+
+    def demographic_scores(self, points, races, sexes):
+        """
+        Demographic risk at each point for that point's race and sex; unknown
+        or missing race/sex score 0, as in the model.
+        """
+        race_codes = np.array([self.races.get(race, len(self.races)) for race in races], dtype=np.int64)
+        sex_codes = np.array([self.sexes.get(sex, len(self.sexes)) for sex in sexes], dtype=np.int64)
+        return np.asarray(self.demographic_risk[self.point_zones(points), race_codes, sex_codes], dtype=float)
+
+    def heatmap_trace(self, race=None, sex=None, stride=1):
+        """
+        The general risk (or one demographic slice) as a plotly Scattergeo of
+        cell centres coloured by risk, so it can be added as a layer on the
+        geo choropleths of the Dash apps. stride thins the grid for display.
+        """
+        import plotly.graph_objects as go
+
+        zones = np.asarray(self.zones[::stride, ::stride], dtype=np.int64)
+        if race is None or sex is None:
+            grid = np.asarray(self.general_risk)[zones]
+        else:
+            grid = np.asarray(self.demographic_risk[:, self.races[race], self.sexes[sex]])[zones]
+        lats = self.lat0 + (np.arange(self.zones.shape[0])[::stride] + 0.5) * self.cell_size
+        lngs = self.lng0 + (np.arange(self.zones.shape[1])[::stride] + 0.5) * self.cell_size
+        grid_lat, grid_lng = np.meshgrid(lats, lngs, indexing='ij')
+        return go.Scattergeo(
+            lat=grid_lat.ravel(),
+            lon=grid_lng.ravel(),
+            mode="markers",
+            marker={
+                "color": grid.ravel(),
+                "colorscale": "OrRd",
+                "opacity": 0.6,
+                "size": 4,
+                "colorbar": {"title": {"text": "risk"}},
+            },
+            hovertemplate="risk=%{marker.color:.2f}<extra></extra>",
+        )
+
+
+def build(model_dir=model_dir, raster_dir=raster_dir, cell_size=cell_size):
+    """
+    Precompute the zone grid for the saved model over the area it was
+    trained on (the scaler's [0, 1] range in lat/lng).
+    """
+    model = RiskModel.load(model_dir)
+    num_zones = len(model.centroids)
+    if num_zones > np.iinfo(np.int16).max:
+        raise ValueError(f"The model has {num_zones} zones; the int16 zone grid holds at most {np.iinfo(np.int16).max}.")
+    lat0, lng0 = (0 - np.asarray(model.scale_min)) / np.asarray(model.scale)
+    lat1, lng1 = (1 - np.asarray(model.scale_min)) / np.asarray(model.scale)
+    num_rows = max(1, int(np.ceil((lat1 - lat0) / cell_size)))
+    num_cols = max(1, int(np.ceil((lng1 - lng0) / cell_size)))
+
+    with swap_lock(raster_dir):
+        tmp_dir = f"{raster_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            zones = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, 'zones.npy'), mode='w+', dtype=np.int16, shape=(num_rows, num_cols))
+
+            # Assign every cell centre to its zone a band of rows at a time
+            lngs = lng0 + (np.arange(num_cols) + 0.5) * cell_size
+            for start in range(0, num_rows, build_rows_per_chunk):
+                stop = min(start + build_rows_per_chunk, num_rows)
+                lats = lat0 + (np.arange(start, stop) + 0.5) * cell_size
+                grid_lat, grid_lng = np.meshgrid(lats, lngs, indexing='ij')
+                points = np.column_stack([grid_lat.ravel(), grid_lng.ravel()])
+                zones[start:stop] = model.assign_zones(model.transform(points)).reshape(stop - start, num_cols)
+            zones.flush()
+            del zones
+
+            np.save(os.path.join(tmp_dir, 'general_risk.npy'), np.asarray(model.general_risk, dtype=np.float32))
+            np.save(os.path.join(tmp_dir, 'demographic_risk.npy'), np.asarray(model.demographic_risk, dtype=np.float32))
+            meta = {
+                'format': raster_format,
+                'lat0': float(lat0),
+                'lng0': float(lng0),
+                'cell_size': cell_size,
+                'shape': [num_rows, num_cols],
+                'races': model.races.tolist(),
+                'sexes': model.sexes.tolist(),
+                'model_version': model.version,
+            }
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f, indent=2)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        replace_directory(tmp_dir, raster_dir)
+    print(f"Risk raster {num_rows}x{num_cols} for model {model.version} saved to {raster_dir}")
+    return meta
+
+
+if __name__ == "__main__":
+    # python risk_raster.py build [model_dir] [raster_dir] [cell_size]
+    if len(sys.argv) < 2 or sys.argv[1] != 'build':
+        print("Usage: python risk_raster.py build [model_dir] [raster_dir] [cell_size]")
+        sys.exit(1)
+    args = sys.argv[2:5]
+    if len(args) == 3:
+        args[2] = float(args[2])
+    build(*args)
@@ -0,0 +1,100 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from caching import LRUCache, SingleFlight, missing
+
+# Point DIRECTIONS_URL at a local stand-in server for tests or offline replay
+directions_url = os.environ.get("DIRECTIONS_URL", "https://maps.googleapis.com/maps/api/directions/json")
+api_key = os.environ.get("GOOGLE_MAPS_API_KEY", "YOUR_GOOGLE_MAPS_API_KEY")  # Replace with your actual API key
+
+
+def normalize_location(location):
+    # "  Atlanta,  GA" and "atlanta, ga" are the same request
+    return " ".join(str(location).lower().split())
+
+
+class GoogleDirectionsBackend:
+    """
+    Fetches route steps from the Google Directions API (or anything that
+    answers with the same JSON) over a pooled keep-alive session.
+    """
+
+    def __init__(self, base_url=directions_url, api_key=api_key, timeout=10, pool_size=16):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, origin, destination):
+        params = {"origin": origin, "destination": destination, "key": self.api_key}
+        response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ValueError("Error fetching route data.")
+        route_data = response.json()
+        if 'routes' not in route_data or not route_data['routes']:
+            raise ValueError("No route found between specified locations.")
+        return route_data['routes'][0]['legs'][0]['steps']
+
+
+class DirectionsClient:
+    """
+    Route step lookups with a bounded TTL + LRU cache keyed on the
+    normalized origin/destination, coalescing of identical in-flight
+    requests and a thread pool for non-blocking fetches. The backend is
+    any object with a fetch(origin, destination) method returning steps.
+    Cached step lists are shared between callers and must not be modified.
+    """
+
+    def __init__(self, backend, cache_size=4096, ttl=6 * 3600, max_workers=8):
+        self.backend = backend
+        self.cache = LRUCache(maxsize=cache_size, ttl=ttl)
+        self.in_flight = SingleFlight()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="directions")
+
+    def route_steps(self, origin, destination):
+        key = (normalize_location(origin), normalize_location(destination))
+        steps = self.cache.get(key)
+        if steps is not missing:
+            return steps
+        return self.in_flight.do(key, lambda: self._fetch(key, origin, destination))
+
+    def _fetch(self, key, origin, destination):
+        # Another caller may have filled the cache while we waited to become the leader
+        steps = self.cache.peek(key)
+        if steps is missing:
+            steps = self.backend.fetch(origin, destination)
+            self.cache.put(key, steps)
+        return steps
+
+    def submit(self, origin, destination):
+        """
+        Fetch in the background; returns a concurrent.futures.Future.
+        """
+        return self.executor.submit(self.route_steps, origin, destination)
+
+    async def route_steps_async(self, origin, destination):
+        return await asyncio.wrap_future(self.submit(origin, destination))
+
+    def fetch_many(self, route_pairs):
+        """
+        Fetch many (origin, destination) pairs concurrently. Returns one entry
+        per pair: the route steps, or the exception raised for that pair.
+        """
+        futures = [self.submit(origin, destination) for origin, destination in route_pairs]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self):
+        return dict(self.cache.stats(), coalesced=self.in_flight.coalesced)
@@ -0,0 +1,75 @@
+import numpy as np
+
+earth_radius_m = 6_371_000.0
+
+
+def decode_polyline(encoded):
+    """
+    Decode a Google encoded polyline into an (n, 2) array of (lat, lng).
+    """
+    values = []
+    value = shift = 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    deltas = np.array(values[:len(values) // 2 * 2], dtype=np.int64).reshape(-1, 2)
+    return np.cumsum(deltas, axis=0) / 1e5
+
+
+def segment_lengths(points):
+    """
+    Haversine length in metres of each segment of a (lat, lng) polyline.
+    """
+    lat, lng = np.radians(points[:, 0]), np.radians(points[:, 1])
+    dlat, dlng = np.diff(lat), np.diff(lng)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlng / 2) ** 2
+    return 2 * earth_radius_m * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def resample(points, resolution_m):
+    """
+    Points spaced every resolution_m metres along a polyline (at the middle
+    of each equal-length piece, so short lines still get one sample).
+    """
+    if len(points) < 2:
+        return points[:1]
+    cumulative = np.concatenate([[0.0], np.cumsum(segment_lengths(points))])
+    total = cumulative[-1]
+    num_samples = max(1, int(np.ceil(total / resolution_m)))
+    positions = (np.arange(num_samples) + 0.5) * (total / num_samples)
+    return np.column_stack([
+        np.interp(positions, cumulative, points[:, 0]),
+        np.interp(positions, cumulative, points[:, 1]),
+    ])
+
+
+def step_points(step):
+    # The step's full geometry, or just its end points when there is no polyline
+    encoded = step.get('polyline', {}).get('points')
+    if encoded:
+        points = decode_polyline(encoded)
+        if len(points):
+            return points
+    start = step['start_location']
+    end = step.get('end_location', start)
+    return np.array([[start['lat'], start['lng']], [end['lat'], end['lng']]], dtype=float)
+
+
+def sample_route(route_steps, resolution_m):
+    """
+    Sample points along every step of a route and the distance each sample
+    stands for: a step's distance is shared equally by its samples.
+    Returns (points, weights) as arrays of shape (n, 2) and (n,).
+    """
+    points, weights = [], []
+    for step in route_steps:
+        samples = resample(step_points(step), resolution_m)
+        points.append(samples)
+        weights.append(np.full(len(samples), step['distance']['value'] / len(samples)))
+    if not points:
+        return np.empty((0, 2)), np.empty(0)
+    return np.concatenate(points), np.concatenate(weights)
@@ -1,49 +1,37 @@
-import pandas as pd
+import hashlib
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import MinMaxScaler
-from collections import defaultdict
-import requests
 import os
+import time
+from caching import LRUCache, SQLiteCache, TieredCache, missing
+from risk_model import load_or_build
+from route_client import DirectionsClient, GoogleDirectionsBackend
+from route_geometry import sample_route
+from risk_raster import RiskRaster
 
-# Load and preprocess data
-data = pd.read_csv('output.csv')
-data = data.dropna(subset=['lat', 'lng'])
-
-# Clustering
-num_clusters = 100
-coords = data[['lat', 'lng']]
-scaler = MinMaxScaler()
-coords_scaled = scaler.fit_transform(coords)
-kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init=10)
-data['risk_zone'] = kmeans.fit_predict(coords_scaled)
-
-# Identify high-risk zones
-violation_counts = data.groupby('risk_zone').size()
-high_risk_threshold = violation_counts.quantile(0.8)  
-high_risk_zones = violation_counts[violation_counts >= high_risk_threshold].index.tolist()
-
-zone_centroids = kmeans.cluster_centers_ 
-data['risk_weight'] = 0.5 
-
-if not high_risk_zones:
-    print("Warning: No high-risk zones dynamically identified. Defaulting to uniform risk weights.")
-
-for zone in high_risk_zones:
-    zone_coords = zone_centroids[zone]
-    indices_in_zone = data['risk_zone'] == zone
-    coords_in_zone = coords_scaled[indices_in_zone]
-    proximity_weight = np.exp(-np.linalg.norm(coords_in_zone - zone_coords, axis=1))
-    
-    data.loc[indices_in_zone, 'risk_weight'] += proximity_weight
-
-data['risk_weight'] = MinMaxScaler().fit_transform(data[['risk_weight']])
-
-# Prepare risk dictionaries
-generalRisk = data.groupby('risk_zone')['risk_weight'].mean().to_dict()
-demographicBasedRisk = defaultdict(
-    lambda: 0,
-    data.groupby(['risk_zone', 'subject_race', 'subject_sex'])['risk_weight'].mean().to_dict(),
+# Fitted scaler, risk zones and risk tables, built offline by `python risk_model.py build`
+model = load_or_build()
+
+# Set RISK_RASTER_DIR to score points from the precomputed risk grids
+# (python risk_raster.py build) instead of running the model per point
+risk_raster = None
+if os.environ.get("RISK_RASTER_DIR"):
+    risk_raster = RiskRaster.load(os.environ["RISK_RASTER_DIR"])
+    if risk_raster.model_version != model.version:
+        print(f"Warning: risk raster was built for model {risk_raster.model_version}, not {model.version}. Ignoring it.")
+        risk_raster = None
+
+# Pooled, cached directions client; swap the backend to replay recorded routes offline
+directions = DirectionsClient(GoogleDirectionsBackend())
+
+# Spacing in metres of the points sampled along each step's polyline. None scores
+# each step by its start location only; smaller values are finer but slower.
+sample_resolution_m = None
+
+# Safety scores keyed by route fingerprint, race, sex and model version. Set
+# SCORE_CACHE_PATH to a SQLite file to share results between worker processes.
+score_cache = TieredCache(
+    LRUCache(maxsize=10_000),
+    SQLiteCache(os.environ["SCORE_CACHE_PATH"]) if os.environ.get("SCORE_CACHE_PATH") else None,
 )
 
 def calculate_combined_risk(base_score, demographic_score, w1=0.7, w2=0.3):
@@ -52,47 +40,129 @@ def calculate_combined_risk(base_score, demographic_score, w1=0.7, w2=0.3):
     """
     return (w1 * base_score) + (w2 * demographic_score)
 
-def calculate_safety_score(route_steps, race=None, sex=None):
+def per_route(values, num_routes):
+    # Accept one value for all routes or one value per route
+    if values is None or isinstance(values, str):
+        return [values] * num_routes
+    values = list(values)
+    if len(values) != num_routes:
+        raise ValueError(f"Expected {num_routes} values, got {len(values)}.")
+    return values
+
+def route_samples(route_steps, resolution_m=None):
+    """
+    Points to score along a route and the distance each one stands for.
+    Without a resolution each step is represented by its start location.
+    """
+    if resolution_m is not None:
+        return sample_route(route_steps, resolution_m)
+    points = np.array([[step['start_location']['lat'], step['start_location']['lng']] for step in route_steps], dtype=float)
+    distances = np.array([step['distance']['value'] for step in route_steps], dtype=float)
+    return points.reshape(-1, 2), distances
+
+def calculate_safety_scores(routes, races=None, sexes=None, resolution_m=None):
+    """
+    Calculate the safety score for many routes at once.
+    `routes` is a list of route step lists; `races` and `sexes` may be a single
+    value for all routes or one value per route. With resolution_m, each step's
+    polyline is resampled every resolution_m metres instead of scoring the step
+    by its start point alone. All points are scaled and assigned to zones in one
+    batch, and the distance-weighted scores are summed per route with segmented sums.
+    """
+    num_routes = len(routes)
+    races = per_route(races, num_routes)
+    sexes = per_route(sexes, num_routes)
+
+    samples = [route_samples(route_steps, resolution_m) for route_steps in routes]
+    points_per_route = np.array([len(points) for points, _ in samples], dtype=np.int64)
+    route_points = np.concatenate([points for points, _ in samples]) if samples else np.empty((0, 2))
+    distances = np.concatenate([weights for _, weights in samples]) if samples else np.empty(0)
+    route_ids = np.repeat(np.arange(num_routes), points_per_route)
+
+    if risk_raster is not None:
+        base_scores = risk_raster.general_scores(route_points)
+        demographic_scores = risk_raster.demographic_scores(
+            route_points,
+            [races[route] for route in route_ids],
+            [sexes[route] for route in route_ids],
+        )
+    else:
+        zones = model.assign_zones(model.transform(route_points.reshape(-1, 2)))
+        base_scores = model.general_scores(zones)
+        # Encode race/sex once per route, then look up every point in one gather
+        race_codes = model.encode_races(races)[route_ids]
+        sex_codes = model.encode_sexes(sexes)[route_ids]
+        demographic_scores = model.demographic_scores(zones, race_codes, sex_codes)
+    combined_scores = calculate_combined_risk(base_scores, demographic_scores)
+
+    total_distance = np.bincount(route_ids, weights=distances, minlength=num_routes)
+    weighted_sum = np.bincount(route_ids, weights=combined_scores * distances, minlength=num_routes)
+    # Routes whose steps all have zero length weight their points equally
+    step_count = np.bincount(route_ids, minlength=num_routes)
+    unweighted_sum = np.bincount(route_ids, weights=combined_scores, minlength=num_routes)
+    risk = np.divide(weighted_sum, total_distance, out=np.zeros(num_routes), where=total_distance > 0)
+    no_distance = (total_distance <= 0) & (step_count > 0)
+    risk[no_distance] = unweighted_sum[no_distance] / step_count[no_distance]
+
+    safety_scores = np.clip((1 - risk) * 100, 0, 100)
+    # Routes without steps (so without points) default to 100
+    safety_scores[points_per_route == 0] = 100
+    return safety_scores
+
+def calculate_safety_score(route_steps, race=None, sex=None, resolution_m=None):
     """
     Calculate the safety score for a given route.
     Incorporates weighted scoring and distance contribution.
     """
-    route_points = np.array([[step['start_location']['lat'], step['start_location']['lng']] for step in route_steps])
-    route_points_df = pd.DataFrame(route_points, columns=['lat', 'lng']) 
-    route_points_scaled = scaler.transform(route_points_df)  
-    zones = kmeans.predict(route_points_scaled)
-
-    distances = [step['distance']['value'] for step in route_steps] 
-    total_distance = sum(distances)
-    
-    weighted_scores = []
-    for i, zone in enumerate(zones):
-        base_score = generalRisk.get(zone, 0)
-        demographic_score = demographicBasedRisk.get((zone, race, sex), 0)
-        combined_score = calculate_combined_risk(base_score, demographic_score)
-        distance_weight = distances[i] / total_distance 
-        weighted_scores.append(combined_score * distance_weight)
-    
-    if not weighted_scores:
+    if not route_steps:
         print("Warning: No weighted scores calculated. Defaulting to 100.")
-        return 100 
-    safety_score = (1 - sum(weighted_scores)) * 100
-    safety_score = max(0, min(safety_score, 100))
-    return safety_score
+        return 100
+    return float(calculate_safety_scores([route_steps], [race], [sex], resolution_m)[0])
+
+def measure_throughput(routes, races=None, sexes=None, repeat=3, resolution_m=None):
+    """
+    Routes scored per second by calculate_safety_scores (best of `repeat` runs).
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        calculate_safety_scores(routes, races, sexes, resolution_m)
+        best = min(best, time.perf_counter() - started)
+    return len(routes) / best if best > 0 else float('inf')
+
+def route_fingerprint(route_steps):
+    """
+    Stable hash of a route's geometry: each step's encoded polyline when
+    available, otherwise its start/end points, plus its distance.
+    """
+    digest = hashlib.sha1()
+    for step in route_steps:
+        polyline = step.get('polyline', {}).get('points')
+        if polyline:
+            digest.update(polyline.encode())
+        else:
+            start, end = step['start_location'], step.get('end_location', {})
+            digest.update(f"{start['lat']},{start['lng']},{end.get('lat')},{end.get('lng')}".encode())
+        digest.update(f"|{step['distance']['value']};".encode())
+    return digest.hexdigest()
+
+def cached_safety_score(route_steps, race=None, sex=None):
+    """
+    calculate_safety_score, memoized on the route, race, sex and model version.
+    """
+    backend = "raster" if risk_raster is not None else "model"
+    key = f"{model.version}:{backend}:{sample_resolution_m}:{route_fingerprint(route_steps)}:{race}:{sex}"
+    score = score_cache.get(key)
+    if score is missing:
+        score = calculate_safety_score(route_steps, race, sex, sample_resolution_m)
+        score_cache.put(key, score)
+    return score
 
 def fetch_route_data(start_location, end_location):
     """
-    Fetch route data from Google Maps API.
+    Fetch route data from Google Maps API (through the shared, cached client).
     """
-    api_key = "YOUR_GOOGLE_MAPS_API_KEY"  # Replace with your actual API key
-    url = f"https://maps.googleapis.com/maps/api/directions/json?origin={start_location}&destination={end_location}&key={api_key}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise ValueError("Error fetching route data.")
-    route_data = response.json()
-    if 'routes' not in route_data or not route_data['routes']:
-        raise ValueError("No route found between specified locations.")
-    return route_data['routes'][0]['legs'][0]['steps']
+    return directions.route_steps(start_location, end_location)
 
 def safetyScore(start_location, end_location, race=None, sex=None):
     """
@@ -100,8 +170,50 @@ def safetyScore(start_location, end_location, race=None, sex=None):
     """
     try:
         route_steps = fetch_route_data(start_location, end_location)
-        score = calculate_safety_score(route_steps, race, sex)
+        score = cached_safety_score(route_steps, race, sex)
         return score
     except Exception as e:
         print(f"Error calculating safety score: {e}")
         return None
+
+def safetyScores(route_pairs, races=None, sexes=None):
+    """
+    Compute safety scores for many (start, end) location pairs. Routes that
+    cannot be fetched score None; the rest are scored in one batch.
+    """
+    races = per_route(races, len(route_pairs))
+    sexes = per_route(sexes, len(route_pairs))
+    scores = [None] * len(route_pairs)
+    fetched = []
+    # Routes are fetched concurrently; repeated pairs only hit the network once
+    for i, result in enumerate(directions.fetch_many(route_pairs)):
+        if isinstance(result, Exception):
+            start_location, end_location = route_pairs[i]
+            print(f"Error fetching route {start_location} -> {end_location}: {result}")
+        else:
+            fetched.append((i, result))
+    if fetched:
+        indices = [i for i, _ in fetched]
+        batch_scores = calculate_safety_scores(
+            [route_steps for _, route_steps in fetched],
+            [races[i] for i in indices],
+            [sexes[i] for i in indices],
+            sample_resolution_m,
+        )
+        for i, score in zip(indices, batch_scores):
+            scores[i] = float(score)
+    return scores
+
+if __name__ == "__main__":
+    # Throughput of batch scoring on synthetic routes spread over the model's area
+    rng = np.random.default_rng(0)
+    low = (0 - model.scale_min) / model.scale
+    high = (1 - model.scale_min) / model.scale
+    synthetic_routes = [
+        [
+            {'start_location': {'lat': lat, 'lng': lng}, 'distance': {'value': float(rng.integers(50, 5000))}}
+            for lat, lng in rng.uniform(low, high, size=(20, 2))
+        ]
+        for _ in range(5000)
+    ]
+    print(f"{measure_throughput(synthetic_routes, 'white', 'male'):,.0f} routes/s")
@@ -1,27 +1,88 @@
+import numpy as np
 import pandas as pd
-import plotly.express as px
-from dash import Dash, dcc, html, Input, Output, callback_context
+from dash import Dash, dcc, html, Input, Output, State, callback_context
 from datetime import datetime
 import dash
+from caching import CallbackCache, file_version
+from figure_templates import ChoroplethTemplate
 
 app = Dash(__name__)
 
+# Ship every weekly frame to the browser once and scrub the slider client-side,
+# instead of building a new figure on the server for every drag event
+clientside_frames = True
+
 data_path = "/content/drive/My Drive/StateData/weekly_traffic_data.parquet"
+# Fingerprint before reading, so the version never describes newer data than was read
+data_version = file_version(data_path)
 data = pd.read_parquet(data_path)
 
+# Callback results keyed on their inputs and data_version, shared by all users
+callback_cache = CallbackCache.from_env()
+app.server.add_url_rule("/cache-stats", "cache_stats", callback_cache.stats)
+
 data['week'] = pd.to_datetime(data['week'])
 data = data.sort_values('week').reset_index(drop=True)
 
-unique_weeks = sorted(data['week'].unique())
+# Sorted week axis; week_values is the raw datetime64 array used for binary search
+unique_weeks = pd.DatetimeIndex(np.sort(data['week'].unique()))
+week_values = unique_weeks.to_numpy()
 total_weeks = len(unique_weeks)
 
+# Dense week x state matrix of cumulative stops, built once. Each state's last value is
+# carried forward, so row i is what groupby('state').last() gave for data up to week i
+# and a slider position becomes a single row lookup.
+cumulative_matrix = (
+    data.groupby(['week', 'state'])['cumulative_traffic_stops'].last()
+    .unstack('state')
+    .reindex(unique_weeks)
+    .ffill()
+)
+matrix_states = cumulative_matrix.columns.to_numpy()
+cumulative_values = cumulative_matrix.to_numpy(dtype=float)
+
 def find_start_index(start_date):
-    if start_date in unique_weeks:
-        return unique_weeks.index(start_date)
-    for i, week in enumerate(unique_weeks):
-        if week > start_date:
-            return i
-    return total_weeks - 1
+    # First week on or after start_date, or the last week if start_date is past the end
+    position = np.searchsorted(week_values, np.datetime64(pd.Timestamp(start_date), 'ns'), side='left')
+    return int(min(position, total_weeks - 1))
+
+def week_frames_payload():
+    # Compact per-week values for the clientside callback; null marks states without data yet
+    values = np.where(np.isnan(cumulative_values), None, np.round(cumulative_values)).tolist()
+    return {
+        "states": matrix_states.tolist(),
+        "weeks": unique_weeks.strftime('%Y-%m-%d').tolist(),
+        "values": values,
+    }
+
+# One fixed trace over all states; each week only swaps z, hover text and title
+map_template = ChoroplethTemplate(
+    matrix_states,
+    hovertemplate='%{hovertext}<extra></extra>',
+    colorscale="Plasma",
+    colorbar={"title": {"text": "cumulative_traffic_stops"}},
+)
+map_template.base.update_layout(transition_duration=500)
+
+def week_frame(week_index):
+    week_totals = cumulative_values[week_index]
+    hover_text = [
+        None if np.isnan(value) else f"State: {state}<br>Cumulative Traffic Stops: {value:,.0f}"
+        for state, value in zip(matrix_states, week_totals)
+    ]
+    title = f"Cumulative Traffic Stops up to {unique_weeks[week_index].strftime('%Y-%m-%d')}"
+    return week_totals, hover_text, title
+
+def build_frame_figure(week_index):
+    return map_template.figure(*week_frame(week_index))
+
+def parse_start_date(start_date):
+    if start_date is None:
+        return unique_weeks[0]
+    try:
+        return pd.to_datetime(start_date)
+    except Exception:
+        return unique_weeks[0]
 
 app.layout = html.Div([
     html.H1("Interactive Weekly Cumulative Traffic Stops Map"),
@@ -29,13 +90,16 @@ app.layout = html.Div([
         html.Label("Select Start Date:"),
         dcc.DatePickerSingle(
             id='start-date-picker',
-            min_date_allowed=min(unique_weeks),
-            max_date_allowed=max(unique_weeks),
-            initial_visible_month=min(unique_weeks),
-            date=min(unique_weeks).date()
+            min_date_allowed=unique_weeks[0],
+            max_date_allowed=unique_weeks[-1],
+            initial_visible_month=unique_weeks[0],
+            date=unique_weeks[0].date()
         )
     ], style={"marginBottom": "20px"}),
-    dcc.Graph(id="choropleth-map"),
+    # Index of the first slider week, worked out once per date-picker change
+    dcc.Store(id="start-index", data=0),
+    dcc.Graph(id="choropleth-map", figure=build_frame_figure(total_weeks - 1)),
+    dcc.Store(id="week-frames", data=week_frames_payload() if clientside_frames else None),
     dcc.Slider(
         id="week-slider",
         min=0,
@@ -49,25 +113,28 @@ app.layout = html.Div([
     html.Div(id="slider-label", style={"textAlign": "center", "marginTop": "20px", "fontSize": "18px"})
 ])
 
+@app.callback(
+    Output("start-index", "data"),
+    [Input("start-date-picker", "date")]
+)
+@callback_cache.memoize(version=data_version)
+def update_start_index(start_date):
+    try:
+        return find_start_index(parse_start_date(start_date))
+    except Exception as e:
+        print(f"Error in update_start_index: {e}")
+        return 0
+
 @app.callback(
     [Output("week-slider", "min"),
      Output("week-slider", "max"),
      Output("week-slider", "marks"),
      Output("week-slider", "value")],
-    [Input("start-date-picker", "date")]
+    [Input("start-index", "data")]
 )
-def update_slider(start_date):
-    if start_date is None:
-        default_start_date = min(unique_weeks)
-    else:
-        try:
-            start_date = pd.to_datetime(start_date)
-            default_start_date = start_date
-        except Exception:
-            default_start_date = min(unique_weeks)
-
+@callback_cache.memoize(version=data_version)
+def update_slider(start_index):
     try:
-        start_index = find_start_index(default_start_date)
         max_index = total_weeks - 1
         num_weeks = max_index - start_index + 1
 
@@ -92,19 +159,11 @@ def update_slider(start_date):
 @app.callback(
     Output("slider-label", "children"),
     [Input("week-slider", "value"),
-     Input("start-date-picker", "date")]
+     Input("start-index", "data")]
 )
-def update_slider_label(selected_week_offset, start_date):
-    if start_date is None:
-        default_start_date = min(unique_weeks)
-    else:
-        try:
-            default_start_date = pd.to_datetime(start_date)
-        except Exception:
-            default_start_date = min(unique_weeks)
-
+@callback_cache.memoize(version=data_version)
+def update_slider_label(selected_week_offset, start_index):
     try:
-        start_index = find_start_index(default_start_date)
         selected_week_index = start_index + selected_week_offset
         selected_week_index = min(selected_week_index, total_weeks - 1)
         selected_week = unique_weeks[selected_week_index]
@@ -122,55 +181,52 @@ def update_slider_label(selected_week_offset, start_date):
         print(f"Error in update_slider_label: {e}")
         return "Error updating label"
 
-@app.callback(
-    Output("choropleth-map", "figure"),
-    [Input("week-slider", "value"),
-     Input("start-date-picker", "date")]
-)
-def update_map(selected_week_offset, start_date):
-    if start_date is None:
-        default_start_date = min(unique_weeks)
-    else:
-        try:
-            default_start_date = pd.to_datetime(start_date)
-        except Exception:
-            default_start_date = min(unique_weeks)
-
+@callback_cache.memoize(version=data_version)
+def update_map(selected_week_offset, start_index):
+    # Patch the figure already in the browser instead of rebuilding it
     try:
-        start_index = find_start_index(default_start_date)
         selected_week_index = start_index + selected_week_offset
         selected_week_index = min(selected_week_index, total_weeks - 1)
-        selected_week = unique_weeks[selected_week_index]
-        filtered_data = data[data['week'] <= selected_week]
-        filtered_data = filtered_data.groupby('state').last().reset_index()
-        filtered_data['hover_text'] = (
-            "State: " + filtered_data['state'] +
-            "<br>Cumulative Traffic Stops: " + filtered_data['cumulative_traffic_stops'].apply(lambda x: f"{x:,.0f}")
-        )
-        fig = px.choropleth(
-            filtered_data,
-            locations="state",
-            locationmode="USA-states",
-            color="cumulative_traffic_stops",
-            hover_name="state",
-            scope="usa",
-            title=f"Cumulative Traffic Stops up to {selected_week.strftime('%Y-%m-%d')}",
-            color_continuous_scale="Plasma",
-            hover_data={'hover_text': True},
-        )
-        fig.update_traces(hovertemplate='%{customdata[0]}<extra></extra>')
-        fig.update_layout(transition_duration=500)
-        return fig
+        return map_template.patch(*week_frame(selected_week_index))
     except Exception as e:
         print(f"Error in update_map: {e}")
-        return {
-            "data": [],
-            "layout": {
-                "title": "Error updating the map.",
-                "xaxis": {"visible": False},
-                "yaxis": {"visible": False},
+        return dash.no_update
+
+if clientside_frames:
+    app.clientside_callback(
+        """
+        function(offset, startIndex, frames, figure) {
+            if (!frames || !figure || offset === null || offset === undefined) {
+                return window.dash_clientside.no_update;
             }
+            var index = Math.min((startIndex || 0) + offset, frames.weeks.length - 1);
+            var values = frames.values[index];
+            var hover = values.map(function (value, i) {
+                if (value === null) {
+                    return null;
+                }
+                return "State: " + frames.states[i] + "<br>Cumulative Traffic Stops: " +
+                    value.toLocaleString("en-US");
+            });
+            var trace = Object.assign({}, figure.data[0], {z: values, hovertext: hover});
+            var layout = Object.assign({}, figure.layout, {
+                title: {text: "Cumulative Traffic Stops up to " + frames.weeks[index]}
+            });
+            return {data: [trace], layout: layout};
         }
+        """,
+        Output("choropleth-map", "figure"),
+        [Input("week-slider", "value"),
+         Input("start-index", "data")],
+        [State("week-frames", "data"),
+         State("choropleth-map", "figure")]
+    )
+else:
+    app.callback(
+        Output("choropleth-map", "figure"),
+        [Input("week-slider", "value"),
+         Input("start-index", "data")]
+    )(update_map)
 
 if __name__ == "__main__":
     app.run_server(debug=True)
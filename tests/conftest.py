@@ -0,0 +1,81 @@
+import os
+import sys
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_stops(path, rows=3000, seed=0):
+    # Geocoded stops in a few clumps around Atlanta, some without a location
+    rng = np.random.default_rng(seed)
+    lat = rng.normal(33.7, 0.3, rows) + rng.integers(0, 3, rows)
+    lng = rng.normal(-84.4, 0.3, rows) + rng.integers(0, 3, rows)
+    lat[rng.random(rows) < 0.02] = np.nan
+    pd.DataFrame({
+        'lat': lat,
+        'lng': lng,
+        'subject_race': rng.choice(['white', 'black', 'hispanic'], rows),
+        'subject_sex': rng.choice(['male', 'female'], rows),
+    }).to_csv(path, index=False)
+
+
+# The training code safety_score.py ran at import before the risk model was split out
+def baseline_fit(data_path, num_clusters):
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import MinMaxScaler
+
+    data = pd.read_csv(data_path)
+    data = data.dropna(subset=['lat', 'lng'])
+    coords = data[['lat', 'lng']]
+    scaler = MinMaxScaler()
+    coords_scaled = scaler.fit_transform(coords)
+    kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init=10)
+    data['risk_zone'] = kmeans.fit_predict(coords_scaled)
+
+    violation_counts = data.groupby('risk_zone').size()
+    high_risk_threshold = violation_counts.quantile(0.8)
+    high_risk_zones = violation_counts[violation_counts >= high_risk_threshold].index.tolist()
+
+    zone_centroids = kmeans.cluster_centers_
+    data['risk_weight'] = 0.5
+    for zone in high_risk_zones:
+        zone_coords = zone_centroids[zone]
+        indices_in_zone = data['risk_zone'] == zone
+        coords_in_zone = coords_scaled[indices_in_zone]
+        proximity_weight = np.exp(-np.linalg.norm(coords_in_zone - zone_coords, axis=1))
+        data.loc[indices_in_zone, 'risk_weight'] += proximity_weight
+    raw_weights = data['risk_weight'].to_numpy().copy()
+    data['risk_weight'] = MinMaxScaler().fit_transform(data[['risk_weight']])
+
+    general_risk = data.groupby('risk_zone')['risk_weight'].mean().to_dict()
+    demographic_risk = defaultdict(
+        lambda: 0,
+        data.groupby(['risk_zone', 'subject_race', 'subject_sex'])['risk_weight'].mean().to_dict(),
+    )
+    return {
+        'scaler': scaler,
+        'kmeans': kmeans,
+        'coords_scaled': coords_scaled,
+        'labels': data['risk_zone'].to_numpy(),
+        'raw_weights': raw_weights,
+        'general_risk': general_risk,
+        'demographic_risk': demographic_risk,
+    }
+
+
+@pytest.fixture(scope='module')
+def stops_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('stops')
+    write_stops(directory / 'output.csv')
+    return directory
+
+
+@pytest.fixture(scope='module')
+def baseline(stops_dir):
+    import risk_model
+    return baseline_fit(str(stops_dir / 'output.csv'), risk_model.num_clusters)
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+
+import pytest
+
+from caching import CallbackCache, LRUCache, SingleFlight, SQLiteCache, TieredCache, file_version, missing
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is missing
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'size': 2, 'maxsize': 2}
+
+
+def test_lru_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=10, ttl=5, clock=clock)
+    cache.put('a', None)
+    clock.now += 4.9
+    assert cache.get('a') is None
+    clock.now += 0.2
+    assert cache.get('a') is missing
+    assert len(cache) == 0
+
+
+def test_lru_peek_leaves_order_and_counters_alone():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.peek('a') == 1
+    cache.put('c', 3)
+    assert cache.peek('a') is missing
+    assert cache.hits == cache.misses == 0
+
+
+def test_single_flight_shares_the_leaders_exception():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(errors) == 4 and all(str(e) == 'upstream failed' for e in errors)
+    # The failure is not remembered: the next call runs again
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_tiered_cache_copies_shared_hits_into_memory(tmp_path):
+    shared = SQLiteCache(str(tmp_path / 'cache.sqlite'))
+    shared.put('a', {'value': 1})
+    cache = TieredCache(LRUCache(maxsize=10), shared)
+    assert cache.get('a') == {'value': 1}
+    assert cache.memory.peek('a') == {'value': 1}
+    assert cache.get('a') == {'value': 1}
+    assert cache.get('b', 'default') == 'default'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['shared']['hits'] == 1
+
+
+def test_sqlite_cache_expires_and_evicts(tmp_path):
+    clock = FakeClock()
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'), maxsize=2, ttl=10, clock=clock, evict_every=1)
+    cache.put('a', 1)
+    clock.now += 1
+    cache.put('b', 2)
+    clock.now += 1
+    assert cache.get('a') == 1
+    clock.now += 1
+    cache.put('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is missing
+    clock.now += 10
+    assert cache.get('c') is missing
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_sqlite_cache_reconnects_after_fork(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'))
+    cache.put('parent', 1)
+    inherited = cache._connection()
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            if cache._connection() is not inherited and cache.get('parent') == 1:
+                cache.put('child', 2)
+                status = 0
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert cache._connection() is inherited
+    assert cache.get('child') == 2
+
+
+def test_callback_cache_memoizes_per_arguments_and_version():
+    cache = CallbackCache(maxsize=10)
+    version = ['v1']
+    calls = []
+
+    @cache.memoize(version=lambda: version[0])
+    def callback(state, age=None):
+        calls.append((state, age))
+        return f"{state}:{age}"
+
+    assert callback('GA', age='18-25') == 'GA:18-25'
+    assert callback('GA', age='18-25') == 'GA:18-25'
+    assert callback('TX') == 'TX:None'
+    assert len(calls) == 2
+    version[0] = 'v2'
+    callback('GA', age='18-25')
+    assert len(calls) == 3
+    assert callback.uncached('NY') == 'NY:None'
+
+
+def test_callback_cache_does_not_cache_exceptions_and_coalesces():
+    cache = CallbackCache(maxsize=10)
+    release = threading.Event()
+    calls = []
+
+    @cache.memoize()
+    def slow(value):
+        calls.append(value)
+        release.wait(5)
+        if len(calls) == 1:
+            raise RuntimeError('first call fails')
+        return value * 2
+
+    results = []
+
+    def call():
+        try:
+            results.append(slow(21))
+        except RuntimeError as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.in_flight.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1 and all(isinstance(result, RuntimeError) for result in results)
+    assert slow(21) == 42
+    assert slow(21) == 42
+    assert len(calls) == 2
+    assert cache.stats()['coalesced'] == 3
+
+
+def test_callback_cache_from_env_shares_results_between_instances(tmp_path, monkeypatch):
+    monkeypatch.setenv('CALLBACK_CACHE_PATH', str(tmp_path / 'callbacks.sqlite'))
+    first, second = CallbackCache.from_env(), CallbackCache.from_env()
+    calls = []
+
+    def callback(value):
+        calls.append(value)
+        return value + 1
+
+    assert first.memoize(version='v1')(callback)(1) == 2
+    assert second.memoize(version='v1')(callback)(1) == 2
+    assert calls == [1]
+
+
+def test_file_version_changes_with_the_files(tmp_path):
+    (tmp_path / 'state=GA').mkdir()
+    part = tmp_path / 'state=GA' / 'part.parquet'
+    part.write_bytes(b'1234')
+    before = file_version(str(tmp_path))
+    assert file_version(str(tmp_path)) == before
+    part.write_bytes(b'12345')
+    assert file_version(str(tmp_path)) != before
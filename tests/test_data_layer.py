@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+data_layer = pytest.importorskip('data_layer')
+
+
+def test_cube_version_is_taken_before_the_data_is_read(tmp_path, monkeypatch):
+    path = tmp_path / 'aggregated_data.csv'
+    pd.DataFrame({'state': ['GA'], 'subject_age': [30], 'subject_race': ['white'],
+                  'subject_sex': ['male'], 'count': [5]}).to_csv(path, index=False)
+    before = data_layer.file_version(str(path))
+    read_stop_data = data_layer.read_stop_data
+
+    def read_then_rebuild(path):
+        data = read_stop_data(path)
+        # The dataset is rewritten right after the cube's data was read
+        with open(path, 'a') as f:
+            f.write('TX,40,black,female,7\n')
+        return data
+
+    monkeypatch.setattr(data_layer, 'read_stop_data', read_then_rebuild)
+    cube = data_layer.load_demographic_cube(str(path))
+    try:
+        assert cube.version == before
+        assert data_layer.dataset_version(str(path)) == before
+        assert data_layer.file_version(str(path)) != before
+    finally:
+        data_layer.load_demographic_cube.cache_clear()
@@ -0,0 +1,65 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from demographic_cube import DemographicCube
+
+
+def stop_data(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    ages = rng.uniform(10, 90, rows)
+    ages[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame({
+        'state': rng.choice(['GA', 'TX', 'CA', 'NY'], rows),
+        'subject_age': ages,
+        'subject_race': rng.choice(['white', 'black', 'hispanic', None], rows),
+        'subject_sex': rng.choice(['male', 'female', None], rows),
+        'count': rng.integers(1, 50, rows),
+    })
+
+
+# The filters and groupby traffic_dash_app.update_map used before the cube
+def baseline_state_counts(data, age, race, sex):
+    data = data.copy()
+    if age is not None:
+        data['subject_age'] = pd.to_numeric(data['subject_age'], errors='coerce')
+        data = data.dropna(subset=['subject_age'])
+        data['subject_age'] = data['subject_age'].astype(int)
+        min_age, max_age = map(int, age.split("-"))
+        data = data[(data['subject_age'] >= min_age) & (data['subject_age'] <= max_age)]
+    if race is not None:
+        data = data[data['subject_race'] == race]
+    if sex is not None:
+        data = data[data['subject_sex'] == sex]
+    return data.groupby("state")["count"].sum().reset_index()
+
+
+@pytest.mark.parametrize('age, race, sex', list(itertools.product(
+    [None, '18-25', '26-35', '60-100', '0-200', '95-99'],
+    [None, 'white', 'black', 'asian'],
+    [None, 'male', 'female'],
+)))
+def test_state_counts_match_the_old_filters(age, race, sex):
+    data = stop_data()
+    expected = baseline_state_counts(data, age, race, sex)
+    actual = DemographicCube(data).state_counts(age, race, sex)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_unknown_selects_missing_values():
+    data = stop_data()
+    cube = DemographicCube(data)
+    no_age = data[data['subject_age'].isna()].groupby('state')['count'].sum()
+    assert dict(zip(cube.states, cube.counts(age='Unknown'))) == no_age.reindex(list(cube.states), fill_value=0).to_dict()
+    no_race = data[data['subject_race'].isna()].groupby('state')['count'].sum()
+    assert dict(zip(cube.states, cube.counts(race='unknown'))) == no_race.reindex(list(cube.states), fill_value=0).to_dict()
+
+
+def test_answers_are_cached_and_read_only():
+    cube = DemographicCube(stop_data())
+    first = cube.counts('18-25', 'White', 'male')
+    assert cube.counts('18-25', 'White', 'male') is first
+    assert not first.flags.writeable
+    assert cube.cache.stats()['hits'] == 1
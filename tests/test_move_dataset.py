@@ -0,0 +1,91 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import moveDataset
+
+
+def write_state_file(path, ages):
+    pd.DataFrame({
+        'subject_age': ages,
+        'subject_sex': ['male', 'female'] * (len(ages) // 2) + ['male'] * (len(ages) % 2),
+    }).to_csv(path, index=False)
+
+
+def ingest(folder, output):
+    return moveDataset.ingest_folder(str(folder), str(output), max_workers=1)
+
+
+def counts(output):
+    data = pd.read_parquet(output)
+    return data.groupby(['state', 'subject_sex'], observed=True)['count'].sum().to_dict()
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    folder, output = tmp_path / 'raw', tmp_path / 'aggregated_data'
+    folder.mkdir()
+    write_state_file(folder / 'ga_statewide.csv', [20, 30, 40, 50])
+    write_state_file(folder / 'tx_statewide.csv', [25, 35])
+    assert ingest(folder, output) == ['GA', 'TX']
+    return folder, output
+
+
+def part_stamp(output, state, name):
+    stat = os.stat(output / f'state={state}' / f'{name}.parquet')
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def manifest(output, state):
+    with open(output / f'state={state}' / moveDataset.manifest_name) as f:
+        return json.load(f)
+
+
+def test_unchanged_files_are_skipped(dataset):
+    folder, output = dataset
+    before = part_stamp(output, 'GA', 'ga_statewide')
+    assert ingest(folder, output) == []
+    assert part_stamp(output, 'GA', 'ga_statewide') == before
+
+
+def test_changed_content_is_rebuilt(dataset):
+    folder, output = dataset
+    write_state_file(folder / 'ga_statewide.csv', [20, 30, 40, 50, 60, 70])
+    assert ingest(folder, output) == ['GA']
+    assert counts(output)[('GA', 'male')] == 3
+    assert manifest(output, 'GA')['ga_statewide.csv']['sha256'] == moveDataset.file_hash(folder / 'ga_statewide.csv')
+
+
+def test_touched_file_with_the_same_content_keeps_its_part(dataset):
+    folder, output = dataset
+    before = part_stamp(output, 'GA', 'ga_statewide')
+    os.utime(folder / 'ga_statewide.csv', (1_000_000_000, 1_000_000_000))
+    assert ingest(folder, output) == []
+    assert part_stamp(output, 'GA', 'ga_statewide') == before
+    # The new mtime is recorded, so the next run skips the file without hashing it
+    assert manifest(output, 'GA')['ga_statewide.csv']['mtime'] == 1_000_000_000
+    assert moveDataset.is_unchanged(str(folder / 'ga_statewide.csv'), manifest(output, 'GA')['ga_statewide.csv'],
+                                    str(output))
+
+
+def test_deleted_source_drops_its_partition(dataset):
+    folder, output = dataset
+    os.remove(folder / 'tx_statewide.csv')
+    assert ingest(folder, output) == ['TX']
+    assert not os.path.exists(output / 'state=TX' / 'tx_statewide.parquet')
+    assert not os.path.exists(output / 'state=TX' / moveDataset.manifest_name)
+    assert set(counts(output)) == {('GA', 'male'), ('GA', 'female')}
+
+
+def test_parts_from_an_older_format_are_rebuilt(dataset):
+    folder, output = dataset
+    entries = manifest(output, 'GA')
+    entries['ga_statewide.csv']['format'] = moveDataset.part_format - 1
+    moveDataset.save_manifest('GA', entries, str(output))
+    before = part_stamp(output, 'GA', 'ga_statewide')
+
+    assert ingest(folder, output) == ['GA']
+    assert part_stamp(output, 'GA', 'ga_statewide') != before
+    assert manifest(output, 'GA')['ga_statewide.csv']['format'] == moveDataset.part_format
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import moveDataset
+
+raw_query = pytest.importorskip('raw_query')
+pytest.importorskip('duckdb')
+
+
+def write_csv(path, text):
+    path.write_text(text.lstrip())
+
+
+@pytest.fixture
+def raw_folder(tmp_path):
+    folder = tmp_path / 'raw'
+    folder.mkdir()
+    # Every grouping column, with pandas' NA strings and fractional, negative, huge and unparseable ages
+    write_csv(folder / 'ga_statewide.csv', """
+subject_age,subject_sex,subject_race,violation,officer_id
+25,male,white,speeding,1
+25.7,male,white,speeding,2
+25,male,white,speeding,3
+NA,female,black,speeding,4
+40,NaN,black,speeding,5
+40,female,,speeding,6
+abc,female,black,equipment,7
+99999,male,hispanic,equipment,8
+1e5,male,hispanic,equipment,9
+inf,male,hispanic,equipment,10
+-3.2,female,white,speeding,11
+61.0,null,white,equipment,12
+61,female,None,equipment,13
+ 33,female,white,equipment,14
+""")
+    # Only some of the grouping columns; a second file of the same state with other columns
+    write_csv(folder / 'ga_atlanta.csv', """
+subject_race,subject_sex,lat
+white,male,33.7
+black,N/A,33.8
+asian,female,33.9
+""")
+    write_csv(folder / 'tx_statewide.csv', """
+subject_age,subject_sex
+19,male
+19.9,male
+#N/A,female
+,female
+""")
+    write_csv(folder / 'ca_statewide.csv', """
+violation
+speeding
+speeding
+<NA>
+""")
+    # No grouping column at all: skipped by both
+    write_csv(folder / 'ny_statewide.csv', """
+lat,lng
+40.7,-74.0
+""")
+    return folder
+
+
+def group_counts(data):
+    data = data.reset_index(drop=True)
+    columns = data[raw_query.stop_columns].astype(object)
+    columns['subject_age'] = data['subject_age'].astype('Float64').astype(object)
+    columns = columns.where(pd.notna(columns), None)
+    keys = [tuple(row) for row in columns.itertuples(index=False)]
+    counts = {}
+    for key, count in zip(keys, data['count'].astype(int)):
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def test_raw_query_counts_match_the_pandas_ingest(raw_folder, tmp_path):
+    ingested = tmp_path / 'ingested'
+    moveDataset.ingest_folder(str(raw_folder), str(ingested), max_workers=1)
+    ingest_counts = group_counts(pd.read_parquet(ingested))
+
+    aggregate_counts = group_counts(raw_query.aggregate(raw_query.stop_columns, str(raw_folder)))
+
+    exported = tmp_path / 'exported'
+    raw_query.export_aggregated_data(str(raw_folder), str(exported))
+    export_counts = group_counts(pd.read_parquet(exported))
+
+    assert aggregate_counts == ingest_counts
+    assert export_counts == ingest_counts
+
+    # Spot-check the cases the three have to agree on
+    assert ingest_counts[('GA', 25.0, 'male', 'white', 'speeding')] == 3
+    assert ingest_counts[('GA', None, 'male', 'hispanic', 'equipment')] == 3
+    assert ingest_counts[('GA', None, 'female', 'black', 'equipment')] == 1
+    assert ingest_counts[('GA', None, 'male', 'white', None)] == 1
+    assert ingest_counts[('TX', 19.0, 'male', None, None)] == 2
+    assert ingest_counts[('CA', None, None, None, 'speeding')] == 2
+    assert ingest_counts[('GA', -3.0, 'female', 'white', 'speeding')] == 1
+    assert sum(ingest_counts.values()) == 9 + 2 + 2 + 2
+    assert not any(key[0] == 'NY' for key in ingest_counts)
@@ -0,0 +1,127 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import directory_swap
+import risk_model
+
+
+@pytest.fixture(scope='module')
+def model(stops_dir):
+    return risk_model.fit_risk_model(str(stops_dir / 'output.csv'))
+
+
+def test_fitted_tables_match_the_baseline(model, baseline):
+    np.testing.assert_allclose(model.centroids, baseline['kmeans'].cluster_centers_)
+    expected_general = np.array([baseline['general_risk'].get(zone, 0) for zone in range(risk_model.num_clusters)])
+    np.testing.assert_allclose(model.general_risk, expected_general, atol=1e-12)
+
+
+def test_saved_model_loads_back(model, tmp_path):
+    model_dir = str(tmp_path / 'risk_model')
+    model.save(model_dir)
+    loaded = risk_model.RiskModel.load(model_dir)
+    assert loaded.version == model.version
+    assert isinstance(loaded.centroids, np.memmap)
+    np.testing.assert_array_equal(loaded.general_risk, model.general_risk)
+    assert sorted(os.listdir(tmp_path)) == ['risk_model']
+
+
+def test_failed_swap_keeps_the_previous_model(model, stops_dir, tmp_path, monkeypatch):
+    model_dir = str(tmp_path / 'risk_model')
+    model.save(model_dir)
+    other = risk_model.fit_risk_model(str(stops_dir / 'output.csv'), num_clusters=5)
+
+    replace = os.replace
+
+    def fail_on_new_dir(src, dst):
+        if '.tmp-' in src:
+            raise OSError('disk full')
+        return replace(src, dst)
+
+    monkeypatch.setattr(directory_swap.os, 'replace', fail_on_new_dir)
+    with pytest.raises(OSError):
+        other.save(model_dir)
+    monkeypatch.undo()
+
+    assert risk_model.RiskModel.load(model_dir).version == model.version
+    assert sorted(os.listdir(tmp_path)) == ['risk_model']
+
+
+def test_load_rejects_arrays_from_another_version(model, stops_dir, tmp_path):
+    # meta.json of one save next to the arrays of another, as if a swap happened between the reads
+    model_dir = str(tmp_path / 'risk_model')
+    risk_model.fit_risk_model(str(stops_dir / 'output.csv'), num_clusters=5).save(model_dir)
+    meta_path = os.path.join(model_dir, 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    with open(meta_path, 'w') as f:
+        json.dump(dict(meta, version=model.version), f)
+
+    with pytest.raises(ValueError):
+        risk_model.RiskModel.load(model_dir)
+    # load_or_build treats it like a missing model and rebuilds
+    rebuilt = risk_model.load_or_build(str(stops_dir / 'output.csv'), model_dir)
+    assert risk_model.RiskModel.load(model_dir).version == rebuilt.version
+
+
+def test_vectorized_weights_match_the_per_zone_loop(baseline):
+    high_risk = risk_model.find_high_risk_zones(baseline['labels'], risk_model.num_clusters)
+    weights = risk_model.raw_risk_weights(
+        baseline['coords_scaled'], baseline['labels'], baseline['kmeans'].cluster_centers_, high_risk, chunk_size=500)
+    np.testing.assert_allclose(weights, baseline['raw_weights'], rtol=0, atol=1e-12)
+
+
+def test_dense_demographic_table_matches_the_baseline(model, baseline, tmp_path):
+    assert model.demographic_risk.shape == (risk_model.num_clusters, len(model.races) + 1, len(model.sexes) + 1)
+    for (zone, race, sex), risk in baseline['demographic_risk'].items():
+        assert model.demographic_score(zone, race, sex) == pytest.approx(risk, abs=1e-6)
+    # Unseen and missing values fall in the all-zero last slot
+    assert model.demographic_score(0, 'unknown race', 'male') == 0
+    assert model.demographic_score(0, 'white', None) == 0
+    assert not model.demographic_risk[:, -1, :].any() and not model.demographic_risk[:, :, -1].any()
+
+    model.save(str(tmp_path / 'risk_model'))
+    loaded = risk_model.RiskModel.load(str(tmp_path / 'risk_model'))
+    assert loaded.races.tolist() == model.races.tolist() and loaded.sexes.tolist() == model.sexes.tolist()
+    zones = np.arange(risk_model.num_clusters)
+    codes = np.zeros(risk_model.num_clusters, dtype=np.int64)
+    np.testing.assert_array_equal(loaded.demographic_scores(zones, codes, codes),
+                                  model.demographic_scores(zones, codes, codes))
+
+
+def per_stop_tables(data_path, model):
+    # The risk tables computed the direct way, from every stop's weight, for the model's zones
+    data = pd.read_csv(data_path).dropna(subset=['lat', 'lng'])
+    coords_scaled = data[['lat', 'lng']].to_numpy() * model.scale + model.scale_min
+    labels = risk_model.ZoneLocator(model.centroids).nearest(coords_scaled)
+    high_risk = risk_model.find_high_risk_zones(labels, len(model.centroids))
+    data['risk_zone'] = labels
+    data['risk_weight'] = risk_model.normalize_weights(
+        risk_model.raw_risk_weights(coords_scaled, labels, model.centroids, high_risk))
+    general = data.groupby('risk_zone')['risk_weight'].mean()
+    demographic = data.groupby(['risk_zone', 'subject_race', 'subject_sex'])['risk_weight'].mean()
+    return general, demographic
+
+
+def test_streaming_tables_match_per_stop_weights(stops_dir, tmp_path):
+    data_path = str(stops_dir / 'output.csv')
+    model = risk_model.fit_risk_model_streaming(data_path, num_clusters=20, chunk_size=700, batch_size=256)
+    general, demographic = per_stop_tables(data_path, model)
+    np.testing.assert_allclose(model.general_risk[general.index], general.to_numpy(), atol=1e-12)
+    for (zone, race, sex), risk in demographic.items():
+        assert model.demographic_score(zone, race, sex) == pytest.approx(risk, abs=1e-6)
+
+    # An update clusters only the new stops but still builds the tables from all of data_path
+    new_data_path = str(tmp_path / 'new_stops.csv')
+    pd.read_csv(data_path).tail(300).to_csv(new_data_path, index=False)
+    updated = risk_model.fit_risk_model_streaming(data_path, num_clusters=20, chunk_size=700, batch_size=256,
+                                                  warm_start=model, epochs=1, cluster_path=new_data_path)
+    assert updated.meta['rows'] == model.meta['rows']
+    assert updated.meta['cluster_path'] == new_data_path
+    np.testing.assert_array_equal(updated.scale, model.scale)
+    general, _ = per_stop_tables(data_path, updated)
+    np.testing.assert_allclose(updated.general_risk[general.index], general.to_numpy(), atol=1e-12)
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+import risk_model
+import risk_raster
+
+
+@pytest.fixture(scope='module')
+def built(stops_dir, tmp_path_factory):
+    directory = tmp_path_factory.mktemp('raster')
+    model = risk_model.fit_risk_model(str(stops_dir / 'output.csv'), num_clusters=20)
+    model.save(str(directory / 'risk_model'))
+    risk_raster.build(str(directory / 'risk_model'), str(directory / 'risk_raster'), cell_size=0.05)
+    return model, directory
+
+
+def cell_centres(raster, count=200, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, raster.zones.shape[0], count)
+    cols = rng.integers(0, raster.zones.shape[1], count)
+    return np.column_stack([raster.lat0 + (rows + 0.5) * raster.cell_size,
+                            raster.lng0 + (cols + 0.5) * raster.cell_size])
+
+
+def test_raster_scores_match_the_model_at_cell_centres(built):
+    model, directory = built
+    raster = risk_raster.RiskRaster.load(str(directory / 'risk_raster'))
+    assert raster.zones.dtype == np.int16
+    assert raster.model_version == model.version
+
+    points = cell_centres(raster)
+    zones = model.assign_zones(model.transform(points))
+    np.testing.assert_array_equal(raster.point_zones(points), zones)
+    np.testing.assert_allclose(raster.general_scores(points), model.general_scores(zones), atol=1e-6)
+
+    races = ['white', 'black', 'unknown', None] * 50
+    sexes = ['male', 'female', 'male', 'female'] * 50
+    expected = model.demographic_scores(zones, model.encode_races(races), model.encode_sexes(sexes))
+    np.testing.assert_allclose(raster.demographic_scores(points, races, sexes), expected, atol=1e-6)
+    assert not raster.demographic_scores(points[:4], ['unknown'] * 4, ['male'] * 4).any()
+
+
+def test_failed_raster_build_keeps_the_previous_raster(built, monkeypatch):
+    _, directory = built
+    raster_dir = str(directory / 'risk_raster')
+    before = risk_raster.RiskRaster.load(raster_dir).meta
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(risk_raster.np, 'save', fail)
+    with pytest.raises(OSError):
+        risk_raster.build(str(directory / 'risk_model'), raster_dir, cell_size=0.01)
+    monkeypatch.undo()
+
+    assert risk_raster.RiskRaster.load(raster_dir).meta == before
+    assert not [name for name in os.listdir(directory) if '.tmp-' in name or '.old-' in name]
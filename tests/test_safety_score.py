@@ -0,0 +1,111 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from caching import LRUCache, SQLiteCache, TieredCache
+
+
+# The per-route scoring safety_score.py did before the batch API
+def baseline_safety_score(baseline, route_steps, race=None, sex=None):
+    route_points = np.array([[step['start_location']['lat'], step['start_location']['lng']] for step in route_steps])
+    route_points_scaled = baseline['scaler'].transform(pd.DataFrame(route_points, columns=['lat', 'lng']))
+    zones = baseline['kmeans'].predict(route_points_scaled)
+    distances = [step['distance']['value'] for step in route_steps]
+    total_distance = sum(distances)
+    weighted_scores = []
+    for i, zone in enumerate(zones):
+        base_score = baseline['general_risk'].get(zone, 0)
+        demographic_score = baseline['demographic_risk'].get((zone, race, sex), 0)
+        combined_score = 0.7 * base_score + 0.3 * demographic_score
+        weighted_scores.append(combined_score * distances[i] / total_distance)
+    if not weighted_scores:
+        return 100
+    return max(0, min((1 - sum(weighted_scores)) * 100, 100))
+
+
+@pytest.fixture(scope='module')
+def safety_score(stops_dir):
+    # safety_score loads (or builds) the model from output.csv in the working directory on import
+    cwd = os.getcwd()
+    os.chdir(stops_dir)
+    try:
+        sys.modules.pop('safety_score', None)
+        module = importlib.import_module('safety_score')
+    finally:
+        os.chdir(cwd)
+    yield module
+    module.directions.executor.shutdown(wait=False)
+
+
+def synthetic_routes(count=50, seed=1):
+    rng = np.random.default_rng(seed)
+    return [
+        [
+            {'start_location': {'lat': lat, 'lng': lng}, 'distance': {'value': float(rng.integers(10, 3000))}}
+            for lat, lng in zip(rng.uniform(33, 36, steps), rng.uniform(-85, -81, steps))
+        ]
+        for steps in rng.integers(1, 12, count)
+    ]
+
+
+def test_batch_scores_match_the_per_route_baseline(safety_score, baseline):
+    routes = synthetic_routes()
+    races = ['white', 'black', None, 'hispanic', 'unknown'] * 10
+    sexes = ['male', 'female', 'male', None, 'female'] * 10
+    scores = safety_score.calculate_safety_scores(routes, races, sexes)
+    expected = [baseline_safety_score(baseline, route, race, sex) for route, race, sex in zip(routes, races, sexes)]
+    np.testing.assert_allclose(scores, expected, atol=1e-6)
+    # One route at a time gives the same scores as the batch
+    single = [safety_score.calculate_safety_score(route, race, sex) for route, race, sex in zip(routes, races, sexes)]
+    np.testing.assert_allclose(single, scores, atol=1e-9)
+
+
+def test_empty_route_scores_100(safety_score):
+    assert safety_score.calculate_safety_score([]) == 100
+    assert list(safety_score.calculate_safety_scores([[]], None, None)) == [100]
+
+
+def test_score_cache_key_follows_model_version_backend_and_resolution(safety_score, monkeypatch):
+    calls = []
+
+    def score(route_steps, race=None, sex=None, resolution_m=None):
+        calls.append(resolution_m)
+        return 50.0
+
+    monkeypatch.setattr(safety_score, 'calculate_safety_score', score)
+    monkeypatch.setattr(safety_score, 'score_cache', TieredCache(LRUCache(maxsize=100)))
+    route = synthetic_routes(count=1)[0]
+
+    def cached():
+        return safety_score.cached_safety_score(route, 'white', 'male')
+
+    cached()
+    cached()
+    assert len(calls) == 1
+    monkeypatch.setattr(safety_score.model, 'version', 'another model')
+    cached()
+    assert len(calls) == 2
+    monkeypatch.setattr(safety_score, 'risk_raster', object())
+    cached()
+    assert len(calls) == 3
+    monkeypatch.setattr(safety_score, 'sample_resolution_m', 25)
+    cached()
+    assert calls[-1] == 25 and len(calls) == 4
+    cached()
+    assert len(calls) == 4
+
+
+def test_workers_share_scores_through_the_sqlite_file(safety_score, monkeypatch, tmp_path):
+    path = str(tmp_path / 'scores.sqlite')
+    route = synthetic_routes(count=1)[0]
+    monkeypatch.setattr(safety_score, 'score_cache', TieredCache(LRUCache(maxsize=100), SQLiteCache(path)))
+    score = safety_score.cached_safety_score(route, 'black', 'female')
+
+    # A second worker has its own memory tier and its own connection to the same file
+    monkeypatch.setattr(safety_score, 'score_cache', TieredCache(LRUCache(maxsize=100), SQLiteCache(path)))
+    monkeypatch.setattr(safety_score, 'calculate_safety_score', lambda *args: pytest.fail('score recomputed'))
+    assert safety_score.cached_safety_score(route, 'black', 'female') == score
@@ -1,110 +1,89 @@
 import dash
-from dash import dcc, html, Input, Output
-import geopandas as gpd
-import pandas as pd
+from dash import dcc, html, Input, Output, State
+from functools import lru_cache
 import plotly.express as px
+from caching import CallbackCache
+from data_layer import load_demographic_cube, load_county_crime_counts, load_us_states, dataset_version
+from figure_templates import ChoroplethTemplate
+from county_geometry import load_county_geojson, zoom_for_span
+
+# Datasets and shapefiles are loaded lazily (and shared) by data_layer
+@lru_cache(maxsize=None)
+def state_map_template():
+    # State map geometry, layout and colorscale are built once; callbacks only patch the counts
+    return ChoroplethTemplate(
+        load_demographic_cube().states,
+        title="Traffic Stops by State",
+        hovertemplate="<b>%{location}</b><br>count=%{z}<extra></extra>",
+        colorscale="Viridis",
+        colorbar={"title": {"text": "count"}},
+    )
 
-counties = gpd.read_file('ne_10m_admin_2_counties/ne_10m_admin_2_counties.shp')  # Replace with your file path
-georgia_counties = counties[counties['ISO_3166_2'] == 'US-13']
-
-# Load crime data for Georgia
-crime_data_path = "crime_count_by_county.csv"  # Replace with your file path
-crime_data = pd.read_csv(crime_data_path)
-
-# Ensure county names match between datasets
-georgia_counties['county_name'] = georgia_counties['NAME']  # Adjust column name if necessary
-merged_data = georgia_counties.merge(crime_data, on='county_name', how='left')
-
-# Load the traffic stop data
-csv_file_path = "aggregated_data.csv"
-aggregated_data = pd.read_csv(csv_file_path)
-
-# Aggregate the data by state
-state_counts = aggregated_data.groupby("state")["count"].sum().reset_index()
-
-# Load shapefile data function from notebook
-def load_us_states(shapefile_path):
-    states = gpd.read_file(shapefile_path)
-    us_states = states[states['iso_a2'] == 'US']
-    return us_states
+def state_map_values(age=None, race=None, sex=None):
+    # States without matching stops are left uncoloured, as before
+    counts = load_demographic_cube().counts(age, race, sex).astype(float)
+    counts[counts == 0] = float("nan")
+    return counts
 
-# Sample shapefile path (replace with actual path in your environment)
-shapefile_path = "ne_110m_admin_1_states_provinces/ne_110m_admin_1_states_provinces.shp"
+@lru_cache(maxsize=None)
+def initial_state_map():
+    return state_map_template().figure(state_map_values())
 
 # Initialize app
 app = dash.Dash(__name__)
-
-# Load and prepare GeoDataFrame
-try:
-    us_states = load_us_states(shapefile_path)
-except Exception as e:
-    us_states = None
-    print(f"Error loading shapefile: {e}")
-
-# Layout
-app.layout = html.Div([
-    html.H1("Traffic Data Visualization App"),
-    html.Label("Select Age Range:"),
-    dcc.Dropdown(
-        id="age-range",
-        options=[
-            {"label": "18-25", "value": "18-25"},
-            {"label": "26-35", "value": "26-35"},
-            {"label": "36-45", "value": "36-45"},
-            {"label": "46-60", "value": "46-60"},
-            {"label": "60+", "value": "60-100"}
-        ],
-        value=None,
-        placeholder="Select age range (optional)"
-    ),
-    html.Label("Select Race:"),
-    dcc.Dropdown(
-        id="race",
-        options=[
-            {"label": "White", "value": "white"},
-            {"label": "Black", "value": "black"},
-            {"label": "Asian", "value": "asian"},
-            {"label": "Hispanic", "value": "hispanic"},
-            {"label": "Other", "value": "other"}
-        ],
-        value=None,
-        placeholder="Select race (optional)"
-    ),
-    html.Label("Select Sex:"),
-    dcc.Dropdown(
-        id="sex",
-        options=[
-            {"label": "Male", "value": "male"},
-            {"label": "Female", "value": "female"}
-        ],
-        value=None,
-        placeholder="Select sex (optional)"
-    ),
-    dcc.Graph(id="map-graph"),
-    html.Div(id="state-info", style={"margin-top": "20px", "font-size": "18px"}),
-    dcc.Graph(id="state-map", style={"margin-top": "20px"})  # Placeholder for county maps
-])
-
-
-def filter_by_age(data, age):
-    if age is None:
-        return data
-    data['subject_age'] = pd.to_numeric(data['subject_age'], errors='coerce')
-    data = data.dropna(subset=['subject_age'])
-    data['subject_age'] = data['subject_age'].astype(int)
-    min_age, max_age = map(int, age.split("-"))
-    data = data[(data['subject_age'] >= min_age) & (data['subject_age'] <= max_age)]
-    return data
-
-def filter_by_race(data, race):
-    if race is None:
-        return data
-    return data[data['subject_race'] == race]
-
-def filter_by_sex(data, sex):
-    if sex is None:
-        return data
-    return data[data['subject_sex'] == sex]
+server = app.server  # For deployment purposes
+
+# Callback results keyed on their inputs and the stop data version, shared by all users
+callback_cache = CallbackCache.from_env()
+server.add_url_rule("/cache-stats", "cache_stats", callback_cache.stats)
+
+# Layout, built on the first page request so importing the app stays cheap
+def serve_layout():
+    return html.Div([
+        html.H1("Traffic Data Visualization App"),
+        html.Label("Select Age Range:"),
+        dcc.Dropdown(
+            id="age-range",
+            options=[
+                {"label": "18-25", "value": "18-25"},
+                {"label": "26-35", "value": "26-35"},
+                {"label": "36-45", "value": "36-45"},
+                {"label": "46-60", "value": "46-60"},
+                {"label": "60+", "value": "60-100"}
+            ],
+            value=None,
+            placeholder="Select age range (optional)"
+        ),
+        html.Label("Select Race:"),
+        dcc.Dropdown(
+            id="race",
+            options=[
+                {"label": "White", "value": "white"},
+                {"label": "Black", "value": "black"},
+                {"label": "Asian", "value": "asian"},
+                {"label": "Hispanic", "value": "hispanic"},
+                {"label": "Other", "value": "other"}
+            ],
+            value=None,
+            placeholder="Select race (optional)"
+        ),
+        html.Label("Select Sex:"),
+        dcc.Dropdown(
+            id="sex",
+            options=[
+                {"label": "Male", "value": "male"},
+                {"label": "Female", "value": "female"}
+            ],
+            value=None,
+            placeholder="Select sex (optional)"
+        ),
+        dcc.Graph(id="map-graph", figure=initial_state_map()),
+        html.Div(id="state-info", style={"margin-top": "20px", "font-size": "18px"}),
+        dcc.Graph(id="state-map", style={"margin-top": "20px"}),  # Placeholder for county maps
+        dcc.Store(id="state-map-shown")  # State whose county map is currently displayed
+    ])
+
+app.layout = serve_layout
 
 
 # Callback
@@ -114,58 +93,74 @@ def filter_by_sex(data, sex):
      Input("race", "value"),
      Input("sex", "value")]
 )
+@callback_cache.memoize(version=dataset_version)
 def update_map(age, race, sex):
-    # Apply filters
-    filtered_data = filter_by_age(aggregated_data, age)
-    filtered_data = filter_by_race(filtered_data, race)
-    filtered_data = filter_by_sex(filtered_data, sex)
-
-    # Aggregate data by state
-    state_data = filtered_data.groupby("state")["count"].sum().reset_index()
-
-    # Generate the choropleth map
-    fig = px.choropleth(
-        state_data,
-        locations="state",
-        locationmode="USA-states",
-        color="count",
-        hover_name="state",
-        hover_data={"count": True},
-        title="Traffic Stops by State",
-        color_continuous_scale="Viridis",
-    )
-
-    # Focus map on the US
-    fig.update_geos(scope="usa")
-
+    # Look up the filtered state totals in the precomputed cube and patch only the z values
+    return state_map_template().patch(state_map_values(age, race, sex))
+
+def county_zoom(state):
+    # The county map is fitted to the state, so bigger states need less detail
+    shape = load_us_states()
+    shape = shape[shape['postal'] == state]
+    if shape.empty:
+        return 'medium'
+    min_x, min_y, max_x, max_y = shape.total_bounds
+    return zoom_for_span(max(max_x - min_x, max_y - min_y))
+
+@lru_cache(maxsize=None)
+def county_map_figure(state):
+    # County figures never change while the app runs, so each is built once
+    # from the simplified, in-memory county geometry
+    geojson = load_county_geojson(state, county_zoom(state))
+    if geojson is None:
+        return None
+    feature_ids = [feature["id"] for feature in geojson["features"]]
+    county_names = [feature["properties"]["county_name"] for feature in geojson["features"]]
+
+    county_crime_counts = load_county_crime_counts()
+    if state in county_crime_counts:
+        crime_count = county_crime_counts[state].reindex(county_names).to_numpy()
+        fig = px.choropleth(
+            geojson=geojson,
+            locations=feature_ids,
+            color=crime_count,  # Use crime data for coloring
+            hover_name=county_names,
+            labels={"color": "crime_count"},
+            title=f"Crime Counts by County in {state}",
+            color_continuous_scale="OrRd",
+        )
+    else:
+        # No county data for this state yet, so just draw its counties
+        fig = px.choropleth(
+            geojson=geojson,
+            locations=feature_ids,
+            hover_name=county_names,
+            title=f"Counties in {state}",
+        )
+        fig.update_traces(showlegend=False)
+    fig.update_geos(fitbounds="locations", visible=False)
     return fig
 
 @app.callback(
-    [Output("state-info", "children"), Output("state-map", "figure")],
-    Input("map-graph", "clickData")
+    [Output("state-info", "children"), Output("state-map", "figure"), Output("state-map-shown", "data")],
+    Input("map-graph", "clickData"),
+    State("state-map-shown", "data")
 )
-def display_state_info(click_data):
+@callback_cache.memoize(version=dataset_version)
+def display_state_info(click_data, shown_state):
     if click_data:
         state = click_data["points"][0]["location"]  # Extract the clicked state
 
-        # If Georgia is clicked, show its county map
-        if state == "GA":
-            fig = px.choropleth(
-                merged_data,
-                geojson=merged_data.__geo_interface__,
-                locations=merged_data.index,
-                color="crime_count",  # Use crime data for coloring
-                hover_name="county_name",
-                hover_data={"crime_count": True},
-                title="Crime Counts by County in Georgia",
-                color_continuous_scale="OrRd",
-            )
-            fig.update_geos(fitbounds="locations", visible=False)
-
-            return f"State: {state}, Clicked: Georgia", fig
+        # Show the clicked state's county map
+        fig = county_map_figure(state)
+        if fig is not None:
+            # Don't resend the geometry if this state's map is already displayed
+            if state == shown_state:
+                return f"State: {state}", dash.no_update, state
+            return f"State: {state}", fig, state
 
     # Default message and empty map
-    return "Click on a state to see more information.", {}
+    return "Click on a state to see more information.", {}, None
 
 
 # Run server